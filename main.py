@@ -16,6 +16,7 @@ from src.utils.logger import get_logger
 async def main():
     """Main function"""
     logger = get_logger()
+    bot = None
 
     try:
         # Create and start bot
@@ -32,6 +33,11 @@ async def main():
         logger.error(traceback.format_exc())
         sys.exit(1)
 
+    finally:
+        # Flush pending data on shutdown
+        if bot is not None:
+            await bot.stop()
+
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM backend interface used by the message and command handlers
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+@dataclass
+class RequestUsage:
+    """Tokens and timings of one AI request (filled in by backend and handler)"""
+    input_tokens: int = 0
+    output_tokens: int = 0
+    history_time: float = 0.0  # loading history and building context
+    queue_time: float = 0.0    # waiting for rate limiter and concurrency slot
+    llm_time: float = 0.0      # model call itself
+    send_time: float = 0.0     # delivering reply to Telegram
+    cached: bool = False       # answered from response cache
+
+
+class LLMBackend(ABC):
+    """Interface between the bot and an LLM provider"""
+
+    @abstractmethod
+    async def get_response(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any],
+        priority: Optional[int] = None,
+        usage: Optional[RequestUsage] = None
+    ) -> str:
+        """Get full AI response, recording tokens and timings into ``usage``"""
+
+    @abstractmethod
+    def stream_response(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any],
+        priority: Optional[int] = None,
+        usage: Optional[RequestUsage] = None
+    ) -> AsyncIterator[str]:
+        """Get AI response as text chunks while it is generated"""
+
+    @abstractmethod
+    def get_cached_response(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any]
+    ) -> Optional[str]:
+        """Get reply from response cache without calling the model, or None"""
+
+    @abstractmethod
+    def set_user_personality(self, user_id: int, personality: str):
+        """Set personality for specific user"""
+
+    @abstractmethod
+    def get_user_personality(self, user_id: int) -> str:
+        """Get personality for specific user"""
+
+    @abstractmethod
+    def clear_user_history(self, user_id: int):
+        """Clear conversation history for user"""
+
+    @abstractmethod
+    def close(self):
+        """Flush state and release resources"""
+
+
+def create_backend(config, **kwargs) -> LLMBackend:
+    """Create LLM backend selected by ``LLM_BACKEND``"""
+    if config.LLM_BACKEND == 'mock':
+        from src.ai.mock_backend import MockBackend, MockSettings
+
+        return MockBackend(
+            mock_settings=MockSettings(
+                latency_mean=config.MOCK_LATENCY_MEAN,
+                latency_sigma=config.MOCK_LATENCY_SIGMA,
+                tokens_per_second=config.MOCK_TOKENS_PER_SECOND,
+                error_rate=config.MOCK_ERROR_RATE,
+                seed=config.MOCK_SEED
+            ),
+            **kwargs
+        )
+
+    from src.ai.gemini_client import GeminiClient
+
+    return GeminiClient(api_key=config.GEMINI_API_KEY, **kwargs)
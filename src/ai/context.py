@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token-budgeted context window with rolling summary
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from src.utils.cache import LRUCache
+
+
+# Summarizer signature: (previous summary, new messages) -> new summary
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.5) -> int:
+    """Cheap token estimate without calling the tokenizer"""
+    return int(len(text) / chars_per_token) + 1
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Estimate tokens of a history message"""
+    return sum(estimate_tokens(part) for part in message.get('parts', []) if isinstance(part, str)) + 4
+
+
+class ContextBuilder:
+    """Fit conversation history into a token budget
+
+    The most recent turns that fit into ``token_budget`` are sent as is.
+    Older turns are represented by a rolling summary, which is regenerated
+    in the background once ``stale_after`` turns have been left out of it.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        stale_after: int = 6,
+        summarizer: Optional[Summarizer] = None,
+        max_users: int = 1000
+    ):
+        self.token_budget = token_budget
+        self.stale_after = stale_after
+        self.summarizer = summarizer
+
+        # user_id -> {'text': summary, 'last': last folded message}
+        self.summaries = LRUCache(capacity=max_users)
+
+        # Users with summary regeneration in progress
+        self._pending: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def build(self, user_id: int, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Build chat history for the next request"""
+        summary = self.summaries.get(user_id) or {'text': '', 'last': None}
+        summary_turns = self._summary_turns(summary['text'])
+        budget = self.token_budget - sum(message_tokens(m) for m in summary_turns)
+
+        # Take newest messages while they fit
+        start = len(history)
+        used = 0
+        while start > 0:
+            tokens = message_tokens(history[start - 1])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+
+        # Chat history has to start with a user turn
+        while start < len(history) and history[start].get('role') != 'user':
+            start += 1
+
+        older = history[:start]
+        if older:
+            self._maybe_refresh_summary(user_id, summary, older)
+
+        return summary_turns + history[start:]
+
+    def clear(self, user_id: int):
+        """Forget summary for user"""
+        self.summaries.pop(user_id)
+
+    def _summary_turns(self, text: str) -> List[Dict[str, Any]]:
+        """Represent summary as a pair of chat turns"""
+        if not text:
+            return []
+        return [
+            {'role': 'user', 'parts': [f"(Кратко о чем мы говорили раньше: {text})"]},
+            {'role': 'model', 'parts': ['угу, помню']},
+        ]
+
+    def _maybe_refresh_summary(self, user_id: int, summary: Dict[str, Any], older: List[Dict[str, Any]]):
+        """Start background summary update when enough turns were left out"""
+        if not self.summarizer or user_id in self._pending:
+            return
+
+        # Messages folded out of the window since the last summary
+        unsummarized = older
+        if summary['last'] is not None:
+            for i in range(len(older) - 1, -1, -1):
+                if older[i] == summary['last']:
+                    unsummarized = older[i + 1:]
+                    break
+
+        if len(unsummarized) < self.stale_after:
+            return
+
+        self._pending.add(user_id)
+        task = asyncio.create_task(self._refresh_summary(user_id, summary['text'], list(unsummarized)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_summary(self, user_id: int, previous: str, messages: List[Dict[str, Any]]):
+        """Regenerate rolling summary"""
+        try:
+            text = await self.summarizer(previous, messages)
+            if text:
+                self.summaries.set(user_id, {'text': text.strip(), 'last': messages[-1]})
+        except Exception as e:
+            print(f"Error updating summary for user {user_id}: {e}")
+        finally:
+            self._pending.discard(user_id)
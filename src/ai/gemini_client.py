@@ -5,84 +5,265 @@ Gemini AI client for generating responses
 """
 
 import asyncio
-import json
-from typing import Dict, List, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Any, Optional, Tuple
 from pathlib import Path
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
+from src.ai.backend import LLMBackend, RequestUsage
+from src.ai.context import ContextBuilder, estimate_tokens, message_tokens
+from src.ai.history_storage import HistoryStorage, create_history_storage
+from src.ai.rate_limiter import (
+    PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW,
+    RateLimiter, backoff_delay, is_quota_error, is_retryable_error
+)
+from src.ai.model_router import ModelEndpoint, ModelRouter
+from src.ai.response_cache import ResponseCache
+from src.core.metrics import TimingStat
+from src.core.persistence import get_persistence
+from src.utils.cache import LRUCache
+
+
+# Safety settings shared by every model
+SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+# Generation settings for background summaries
+SUMMARY_CONFIG = genai.types.GenerationConfig(
+    temperature=0.2,
+    max_output_tokens=120,
+)
+
+
+def personality_key(personality_config: Dict[str, Any]) -> str:
+    """Stable id of personality config (display names may repeat)"""
+    return personality_config.get('key') or personality_config.get('name', '')
+
 
 class ConversationHistory:
     """Manage conversation history for users"""
 
-    def __init__(self, data_dir: Path, max_length: int = 20):
+    def __init__(
+        self,
+        data_dir: Path,
+        max_length: int = 20,
+        storage: Optional[HistoryStorage] = None,
+        cache_size: int = 1000,
+        cache_max_bytes: Optional[int] = None,
+        cache_idle_ttl: Optional[float] = None
+    ):
         self.data_dir = data_dir
         self.history_dir = data_dir / 'history'
         self.history_dir.mkdir(parents=True, exist_ok=True)
 
         self.max_length = max_length
-        self.conversations: Dict[int, List[Dict[str, Any]]] = {}
+        self.storage = storage or create_history_storage('sqlite', self.history_dir, max_length)
+
+        # Loaded conversations, evicted to storage when idle or over limits
+        self.conversations = LRUCache(
+            capacity=cache_size,
+            max_bytes=cache_max_bytes,
+            idle_ttl=cache_idle_ttl,
+            size_of=self._estimate_size,
+            on_evict=self._on_evict
+        )
 
-    def add_message(self, user_id: int, role: str, content: str):
+        # Unload idle conversations even when nobody touches the cache
+        if cache_idle_ttl and self.storage.persistence:
+            self.storage.persistence.add_periodic(self.conversations.evict_idle, min(cache_idle_ttl, 60.0))
+
+    def add_message(self, user_id: int, role: str, content: str) -> Dict[str, Any]:
         """Add message to conversation history"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
+        history = self.get_history(user_id)
 
-        self.conversations[user_id].append({
+        message = {
             'role': role,
             'parts': [content]
-        })
+        }
+        history.append(message)
 
         # Keep only last N messages
-        if len(self.conversations[user_id]) > self.max_length:
-            self.conversations[user_id] = self.conversations[user_id][-self.max_length:]
+        if len(history) > self.max_length:
+            del history[:-self.max_length]
 
-        # Save to file
-        self._save_history(user_id)
+        # Refresh cached size
+        self.conversations.set(user_id, history)
+
+        # Persist message
+        try:
+            self.storage.append(user_id, message, history)
+        except Exception as e:
+            print(f"Error saving history for user {user_id}: {e}")
+
+        return message
 
     def get_history(self, user_id: int) -> List[Dict[str, Any]]:
         """Get conversation history for user"""
-        if user_id not in self.conversations:
-            self._load_history(user_id)
-        return self.conversations.get(user_id, [])
+        history = self.conversations.get(user_id)
+        if history is None:
+            history = self._load_history(user_id)
+            self.conversations.set(user_id, history)
+        return history
 
     def clear_history(self, user_id: int):
         """Clear conversation history for user"""
-        if user_id in self.conversations:
-            self.conversations[user_id] = []
-            self._save_history(user_id)
-
-    def _save_history(self, user_id: int):
-        """Save conversation history to file"""
+        self.conversations.set(user_id, [])
         try:
-            history_file = self.history_dir / f'user_{user_id}.json'
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversations.get(user_id, []), f, ensure_ascii=False, indent=2)
+            self.storage.replace(user_id, [])
         except Exception as e:
-            print(f"Error saving history for user {user_id}: {e}")
+            print(f"Error clearing history for user {user_id}: {e}")
+
+    def close(self):
+        """Flush pending writes and close storage"""
+        self.storage.close()
 
-    def _load_history(self, user_id: int):
-        """Load conversation history from file"""
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get in-memory conversation cache counters"""
+        return self.conversations.get_stats()
+
+    def _load_history(self, user_id: int) -> List[Dict[str, Any]]:
+        """Load conversation history from storage"""
         try:
-            history_file = self.history_dir / f'user_{user_id}.json'
-            if history_file.exists():
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    self.conversations[user_id] = json.load(f)
+            return self.storage.load(user_id, self.max_length)
         except Exception as e:
             print(f"Error loading history for user {user_id}: {e}")
-            self.conversations[user_id] = []
+            return []
+
+    def _on_evict(self, user_id: int, history: List[Dict[str, Any]]):
+        """Make sure evicted conversation is on disk"""
+        self.storage.forget(user_id)
+
+        # Background flusher already has the pending writes scheduled
+        if self.storage.persistence and self.storage.persistence.running:
+            return
+        self.storage.flush()
+
+    @staticmethod
+    def _estimate_size(history: List[Dict[str, Any]]) -> int:
+        """Rough memory footprint of a conversation in bytes"""
+        return sum(
+            200 + sum(len(part) * 2 for part in message.get('parts', []) if isinstance(part, str))
+            for message in history
+        )
+
+
+@dataclass
+class LLMRequest:
+    """Everything needed to send one chat turn to the model"""
+    user_id: int
+    endpoint: ModelEndpoint
+    model: Any
+    chat: Any
+    history: List[Dict[str, Any]]
+    user_message: Dict[str, Any]
+    prompt: str
+    tokens: int
+    priority: int
 
 
-class GeminiClient:
+class GeminiClient(LLMBackend):
     """Gemini AI client for generating girlfriend-style responses"""
 
-    def __init__(self, api_key: str, data_dir: Path, max_history_length: int = 20):
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+    ERROR_RESPONSE = "блин чет у меня глюк... попробуй еще раз"
+
+    def __init__(
+        self,
+        api_key: str,
+        data_dir: Path,
+        max_history_length: int = 20,
+        history_backend: str = 'sqlite',
+        history_cache_size: int = 1000,
+        history_cache_max_bytes: Optional[int] = None,
+        history_cache_idle_ttl: Optional[float] = None,
+        history_token_budget: int = 1500,
+        summary_stale_turns: int = 6,
+        enable_summary: bool = True,
+        chat_session_pool_size: int = 500,
+        llm_max_concurrency: int = 8,
+        response_cache: Optional[ResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 3,
+        retry_base_delay: float = 1.0,
+        models: Optional[List[str]] = None,
+        router_latency_threshold: float = 8.0,
+        router_error_threshold: float = 0.5,
+        router_cooldown: float = 60.0,
+        personalities: Optional[Dict[str, Dict[str, Any]]] = None,
+        model_factory: Optional[Callable[..., Any]] = None
+    ):
+        # Configure Gemini unless models come from elsewhere (mock backend)
+        if model_factory is None:
+            genai.configure(api_key=api_key)
+            model_factory = genai.GenerativeModel
+        self.model_factory = model_factory
+
+        # Model pool, first model is preferred
+        self.router = ModelRouter(
+            models or ['gemini-1.5-flash'],
+            model_factory,
+            latency_threshold=router_latency_threshold,
+            error_threshold=router_error_threshold,
+            cooldown=router_cooldown
+        )
+
+        # One model per (model name, personality) with the personality
+        # prompt as system instruction, built once up front
+        self.personality_models: Dict[tuple, Any] = {}
+        for endpoint in self.router.endpoints.values():
+            for personality_config in (personalities or {}).values():
+                self._get_personality_model(endpoint, personality_config)
 
         # Conversation history
-        self.history = ConversationHistory(data_dir, max_history_length)
+        self.history = ConversationHistory(
+            data_dir,
+            max_history_length,
+            storage=create_history_storage(
+                history_backend,
+                data_dir / 'history',
+                max_history_length,
+                persistence=get_persistence()
+            ),
+            cache_size=history_cache_size,
+            cache_max_bytes=history_cache_max_bytes,
+            cache_idle_ttl=history_cache_idle_ttl
+        )
+
+        # Token-budgeted context window
+        self.context_builder = ContextBuilder(
+            token_budget=history_token_budget,
+            stale_after=summary_stale_turns,
+            summarizer=self._summarize if enable_summary else None,
+            max_users=history_cache_size
+        )
+
+        # Limit in-flight LLM calls; executor is only used when the SDK
+        # has no async method
+        self.llm_semaphore = asyncio.Semaphore(llm_max_concurrency)
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_max_concurrency, thread_name_prefix='gemini')
+        self.llm_in_flight = 0
+        self.llm_waiting = 0
+        self.llm_queue_wait = TimingStat()
+
+        # Client-side quota limiter and retry policy
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retries = 0
+
+        # Live chat sessions: user_id -> (chat, history the chat holds, model)
+        self.chat_sessions = LRUCache(capacity=chat_session_pool_size)
+
+        # Optional cache of replies to short frequent messages
+        self.response_cache = response_cache
 
         # User personalities
         self.user_personalities: Dict[int, str] = {}
@@ -99,52 +280,493 @@ class GeminiClient:
         self,
         user_id: int,
         message: str,
-        personality_config: Dict[str, Any]
+        personality_config: Dict[str, Any],
+        priority: Optional[int] = None,
+        usage: Optional[RequestUsage] = None
     ) -> str:
         """Get AI response with personality"""
+        request = None
         try:
-            # Get conversation history
-            history = self.history.get_history(user_id)
-
-            # Add user message to history
-            self.history.add_message(user_id, 'user', message)
+            cached = self.get_cached_response(user_id, message, personality_config)
+            if cached is not None:
+                if usage is not None:
+                    usage.cached = True
+                return cached
 
-            # Create full prompt with personality
-            system_prompt = personality_config.get('prompt', '')
-            full_prompt = f"{system_prompt}\n\nСообщение: {message}\n\nОтветь естественно, как подруга:"
-
-            # Create chat with history
-            chat = self.model.start_chat(history=history[:-1] if history else [])
+            request = self._prepare_request(user_id, message, personality_config, priority, usage)
 
             # Get response
-            response = await asyncio.to_thread(
-                chat.send_message,
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=personality_config.get('temperature', 0.9),
-                    top_p=0.95,
-                    top_k=40,
-                    max_output_tokens=personality_config.get('max_tokens', 200),
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+            response = await self._call_llm(
+                request.chat,
+                'send_message',
+                request.prompt,
+                endpoint=request.endpoint,
+                tokens=request.tokens,
+                priority=request.priority,
+                usage=usage,
+                reroute=partial(self._reroute_request, request, personality_config)
             )
-
             ai_response = response.text
+            self._fill_usage(usage, getattr(response, 'usage_metadata', None), request, ai_response)
 
-            # Add AI response to history
-            self.history.add_message(user_id, 'model', ai_response)
-
+            self._finish_request(request, ai_response, personality_config)
             return ai_response
 
         except Exception as e:
+            self.chat_sessions.pop(user_id)
             print(f"Gemini AI error: {e}")
-            return "блин чет у меня глюк... попробуй еще раз"
+            return self.ERROR_RESPONSE
+
+        finally:
+            if request is not None:
+                self.router.release(request.endpoint)
+
+    async def stream_response(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any],
+        priority: Optional[int] = None,
+        usage: Optional[RequestUsage] = None
+    ) -> AsyncIterator[str]:
+        """Get AI response with personality as text chunks while it is generated"""
+        chunks: List[str] = []
+        request = None
+        pump = None
+        try:
+            cached = self.get_cached_response(user_id, message, personality_config)
+            if cached is not None:
+                if usage is not None:
+                    usage.cached = True
+                yield cached
+                return
+
+            request = self._prepare_request(user_id, message, personality_config, priority, usage)
+
+            # Producer owns the LLM slot, a slow consumer doesn't hold it
+            queue: asyncio.Queue = asyncio.Queue()
+            pump = asyncio.create_task(self._pump_stream(request, queue))
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                chunks.append(text)
+                yield text
+
+            waited, elapsed, usage_metadata = await pump
+            if usage is not None:
+                usage.queue_time += waited
+                usage.llm_time += elapsed
+            self._fill_usage(usage, usage_metadata, request, ''.join(chunks))
+            self._finish_request(request, ''.join(chunks), personality_config)
+
+        except Exception as e:
+            self.chat_sessions.pop(user_id)
+            print(f"Gemini AI error: {e}")
+            if not chunks:
+                yield self.ERROR_RESPONSE
+
+        finally:
+            if pump is not None and not pump.done():
+                # Consumer stopped early
+                pump.cancel()
+            if request is not None:
+                self.router.release(request.endpoint)
+
+    async def _pump_stream(self, request: LLMRequest, queue: asyncio.Queue):
+        """Stream SDK chunks into queue, returns (waited, llm seconds, usage metadata)
+
+        Only awaits on the SDK count as LLM time. ``None`` marks the end.
+        """
+        elapsed = 0.0
+        usage_metadata = None
+        try:
+            async with self._llm_slot(request.tokens, request.priority) as waited:
+                try:
+                    chat = request.chat
+                    async_method = getattr(chat, 'send_message_async', None)
+                    loop = asyncio.get_running_loop()
+
+                    started = time.monotonic()
+                    if async_method is not None:
+                        response = await async_method(request.prompt, stream=True)
+                        iterator = response.__aiter__()
+                        next_chunk = iterator.__anext__
+                    else:
+                        # Iterate blocking stream in LLM executor
+                        response = await loop.run_in_executor(
+                            self.llm_executor,
+                            partial(chat.send_message, request.prompt, stream=True)
+                        )
+                        iterator = iter(response)
+                        next_chunk = partial(loop.run_in_executor, self.llm_executor, next, iterator, None)
+                    elapsed += time.monotonic() - started
+
+                    while True:
+                        started = time.monotonic()
+                        try:
+                            chunk = await next_chunk()
+                        except StopAsyncIteration:
+                            chunk = None
+                        elapsed += time.monotonic() - started
+                        if chunk is None:
+                            break
+                        # Last chunk carries usage for the whole stream
+                        usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+                        if chunk.text:
+                            queue.put_nowait(chunk.text)
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # Only failures of the model itself count against it
+                    self.router.record(request.endpoint, elapsed, False)
+                    raise
+
+            self.router.record(request.endpoint, elapsed, True)
+            self._record_token_usage(usage_metadata, request.tokens)
+            return waited, elapsed, usage_metadata
+
+        finally:
+            queue.put_nowait(None)
+
+    def get_cached_response(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any]
+    ) -> Optional[str]:
+        """Answer from response cache, recording both turns in history"""
+        if not self.response_cache:
+            return None
+
+        cached = self.response_cache.get(message, personality_key(personality_config), self.history.get_history(user_id))
+        if cached is None:
+            return None
+
+        self.history.add_message(user_id, 'user', message)
+        self.history.add_message(user_id, 'model', cached)
+        return cached
+
+    def _prepare_request(
+        self,
+        user_id: int,
+        message: str,
+        personality_config: Dict[str, Any],
+        priority: Optional[int] = None,
+        usage: Optional[RequestUsage] = None
+    ) -> LLMRequest:
+        """Record user message and build chat and token estimate"""
+        started = time.monotonic()
+
+        # Fit conversation history into token budget
+        history = self.context_builder.build(user_id, self.history.get_history(user_id))
+
+        # Add user message to history
+        user_message = self.history.add_message(user_id, 'user', message)
+
+        if usage is not None:
+            usage.history_time += time.monotonic() - started
+
+        # Pick healthy model, personality may ask for a specific one
+        endpoint = self.router.choose(personality_config.get('model'))
+        try:
+            model = self._get_personality_model(endpoint, personality_config)
+
+            # Reuse chat session while it still holds the same context
+            chat = self._get_chat_session(user_id, history, model)
+        except BaseException:
+            self.router.release(endpoint)
+            raise
+
+        # Estimated request size for the rate limiter
+        tokens = (
+            sum(message_tokens(m) for m in history)
+            + estimate_tokens(personality_config.get('prompt', ''))
+            + estimate_tokens(message)
+            + personality_config.get('max_tokens', 200)
+        )
+
+        return LLMRequest(
+            user_id=user_id,
+            endpoint=endpoint,
+            model=model,
+            chat=chat,
+            history=history,
+            user_message=user_message,
+            prompt=message,
+            tokens=tokens,
+            priority=self._default_priority(history, priority)
+        )
+
+    def _reroute_request(self, request: LLMRequest, personality_config: Dict[str, Any]) -> Tuple[ModelEndpoint, Any]:
+        """Move request to the next healthy model, returns endpoint and its chat"""
+        request.endpoint = self.router.choose(personality_config.get('model'))
+        request.model = self._get_personality_model(request.endpoint, personality_config)
+        request.chat = request.model.start_chat(history=request.history)
+        return request.endpoint, request.chat
+
+    def _get_personality_model(self, endpoint: ModelEndpoint, personality_config: Dict[str, Any]):
+        """Get model with personality prompt as system instruction"""
+        key = (endpoint.name, personality_key(personality_config))
+        model = self.personality_models.get(key)
+        if model is None:
+            model = self.personality_models[key] = self._create_personality_model(endpoint.name, personality_config)
+        return model
+
+    def _create_personality_model(self, model_name: str, personality_config: Dict[str, Any]):
+        """Build model with frozen generation and safety settings"""
+        return self.model_factory(
+            model_name,
+            system_instruction=personality_config.get('prompt') or None,
+            generation_config=genai.types.GenerationConfig(
+                temperature=personality_config.get('temperature', 0.9),
+                top_p=0.95,
+                top_k=40,
+                max_output_tokens=personality_config.get('max_tokens', 200),
+            ),
+            safety_settings=SAFETY_SETTINGS
+        )
+
+    @staticmethod
+    def _default_priority(history: List[Dict[str, Any]], priority: Optional[int]) -> int:
+        """First replies go before long-running chats"""
+        if priority is not None:
+            return priority
+        return PRIORITY_NORMAL if history else PRIORITY_HIGH
+
+    def _finish_request(self, request: LLMRequest, ai_response: str, personality_config: Dict[str, Any]):
+        """Record AI response and keep chat session for reuse"""
+        user_id = request.user_id
+
+        if self.response_cache:
+            # Cache key uses history before this exchange
+            self.response_cache.put(
+                request.user_message['parts'][0],
+                personality_key(personality_config),
+                self.history.get_history(user_id)[:-1],
+                ai_response
+            )
+
+        # Add AI response to history
+        model_message = self.history.add_message(user_id, 'model', ai_response)
+
+        # Chat session appended both turns itself
+        self.chat_sessions.set(user_id, (
+            request.chat,
+            request.history + [request.user_message, model_message],
+            request.model
+        ))
+
+    @staticmethod
+    def _fill_usage(usage: Optional[RequestUsage], metadata, request: LLMRequest, ai_response: str):
+        """Store token counts reported by SDK, estimating what is missing"""
+        if usage is None:
+            return
+
+        prompt_tokens = getattr(metadata, 'prompt_token_count', None) if metadata else None
+        output_tokens = getattr(metadata, 'candidates_token_count', None) if metadata else None
+        usage.input_tokens += prompt_tokens or (
+            sum(message_tokens(m) for m in request.history) + message_tokens(request.user_message)
+        )
+        usage.output_tokens += output_tokens or estimate_tokens(ai_response)
+
+    @asynccontextmanager
+    async def _llm_slot(self, tokens: int, priority: int):
+        """Wait for quota and a free LLM concurrency slot, yields seconds waited"""
+        queued_at = time.monotonic()
+        await self.rate_limiter.acquire(tokens, priority)
+        self.llm_waiting += 1
+        try:
+            await self.llm_semaphore.acquire()
+        finally:
+            self.llm_waiting -= 1
+
+        waited = time.monotonic() - queued_at
+        self.llm_queue_wait.record(waited)
+        self.llm_in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.llm_in_flight -= 1
+            self.llm_semaphore.release()
+
+    async def _call_llm(
+        self,
+        target,
+        method: str,
+        *args,
+        endpoint: ModelEndpoint,
+        tokens: int,
+        priority: int,
+        usage: Optional[RequestUsage] = None,
+        reroute: Optional[Callable[[], Tuple[ModelEndpoint, Any]]] = None,
+        **kwargs
+    ):
+        """Call SDK method under rate and concurrency limits, retrying 429/5xx
+
+        Queue and call times of every attempt are added to ``usage``. Once the
+        breaker of ``endpoint`` opens, retries go to the endpoint and target
+        returned by ``reroute`` (or stop when there is none).
+        """
+        attempt = 0
+        while True:
+            started = None
+            try:
+                async with self._llm_slot(tokens, priority) as waited:
+                    if usage is not None:
+                        usage.queue_time += waited
+                    started = time.monotonic()
+                    async_method = getattr(target, f'{method}_async', None)
+                    if async_method is not None:
+                        response = await async_method(*args, **kwargs)
+                    else:
+                        loop = asyncio.get_running_loop()
+                        response = await loop.run_in_executor(
+                            self.llm_executor,
+                            partial(getattr(target, method), *args, **kwargs)
+                        )
+
+                elapsed = time.monotonic() - started
+                self.router.record(endpoint, elapsed, True)
+                self._record_token_usage(getattr(response, 'usage_metadata', None), tokens)
+                if usage is not None:
+                    usage.llm_time += elapsed
+                return response
+
+            except Exception as e:
+                if started is not None:
+                    elapsed = time.monotonic() - started
+                    self.router.record(endpoint, elapsed, False)
+                    if usage is not None:
+                        usage.llm_time += elapsed
+
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+
+                if endpoint.state != ModelEndpoint.CLOSED:
+                    # Don't keep retrying a model the breaker took out
+                    if reroute is None:
+                        raise
+                    failed = endpoint
+                    self.router.release(failed)
+                    endpoint, target = reroute()
+                    if endpoint is failed:
+                        raise
+
+                delay = backoff_delay(attempt, self.retry_base_delay)
+                if is_quota_error(e):
+                    # Everyone waits, not just this request
+                    self.rate_limiter.pause(delay)
+
+                attempt += 1
+                self.retries += 1
+                print(f"Gemini request failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _record_token_usage(self, usage, estimated: int):
+        """Correct rate limiter with real token usage when SDK reports it"""
+        total = getattr(usage, 'total_token_count', None) if usage else None
+        if total:
+            self.rate_limiter.record_usage(estimated, total)
+
+    def get_llm_stats(self) -> Dict[str, Any]:
+        """Get LLM concurrency counters and queue wait times"""
+        return {
+            'in_flight': self.llm_in_flight,
+            'waiting': self.llm_waiting,
+            'retries': self.retries,
+            'queue_wait': self.llm_queue_wait.get_stats(),
+            'rate_limiter': self.rate_limiter.get_stats(),
+        }
+
+    def _get_chat_session(self, user_id: int, history: List[Dict[str, Any]], model):
+        """Get pooled chat session for context or start a new one"""
+        session = self.chat_sessions.get(user_id)
+        if session is not None:
+            chat, session_history, session_model = session
+            if session_model is model:
+                if session_history == history:
+                    return chat
+
+                # Window slid: drop the oldest turns instead of rebuilding
+                dropped = self._dropped_turns(session_history, history)
+                if dropped is not None and len(chat.history) == len(session_history):
+                    turns = list(chat.history)
+                    chat.history = turns[:dropped.start] + turns[dropped.stop:]
+                    return chat
+
+        return model.start_chat(history=history)
+
+    @staticmethod
+    def _dropped_turns(session_history: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> Optional[slice]:
+        """Turns to cut from pooled history to get history, None if it is not just a cut"""
+        dropped = len(session_history) - len(history)
+        if dropped <= 0:
+            return None
+
+        # Kept head (summary turns) and kept tail (newest turns) must cover history
+        prefix = 0
+        while prefix < len(history) and session_history[prefix] == history[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < len(history) and session_history[-1 - suffix] == history[-1 - suffix]:
+            suffix += 1
+
+        start = len(history) - suffix
+        if start > prefix:
+            return None
+        return slice(start, start + dropped)
+
+    def get_router_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get per-model latency, error rate and breaker state"""
+        return self.router.get_stats()
+
+    def get_session_stats(self) -> Dict[str, Any]:
+        """Get chat session pool counters"""
+        return self.chat_sessions.get_stats()
+
+    async def _summarize(self, previous: str, messages: List[Dict[str, Any]]) -> str:
+        """Fold older messages into rolling conversation summary"""
+        dialog = '\n'.join(
+            f"{'Он' if message['role'] == 'user' else 'Я'}: {' '.join(message['parts'])}"
+            for message in messages
+        )
+        prompt = (
+            "Обнови краткое содержание переписки (не больше 60 слов, только факты и договоренности).\n\n"
+            f"Предыдущее содержание: {previous or 'нет'}\n\n"
+            f"Новые сообщения:\n{dialog}"
+        )
+
+        endpoint = self.router.choose()
+
+        def reroute():
+            nonlocal endpoint
+            endpoint = self.router.choose()
+            return endpoint, endpoint.model
+
+        try:
+            response = await self._call_llm(
+                endpoint.model,
+                'generate_content',
+                prompt,
+                endpoint=endpoint,
+                tokens=estimate_tokens(prompt) + 120,
+                priority=PRIORITY_LOW,
+                reroute=reroute,
+                generation_config=SUMMARY_CONFIG
+            )
+        finally:
+            self.router.release(endpoint)
+        return response.text
 
     def clear_user_history(self, user_id: int):
         """Clear conversation history for user"""
         self.history.clear_history(user_id)
+        self.context_builder.clear(user_id)
+        self.chat_sessions.pop(user_id)
+
+    def close(self):
+        """Flush conversation history to disk"""
+        self.history.close()
+        self.llm_executor.shutdown(wait=False)
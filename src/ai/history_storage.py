@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage backends for conversation history
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from src.core.persistence import PersistenceService
+
+
+class HistoryStorage(ABC):
+    """Base class for conversation history storage backends
+
+    Writes are queued as operations and applied in order by ``flush()``.
+    When a ``PersistenceService`` is attached, flushing happens in its
+    background thread; otherwise the backend decides when to flush inline.
+    ``load()`` never flushes: writes not yet on disk are replayed from
+    memory on top of what is stored. Operations a failed flush did not
+    write stay queued for the next one.
+    """
+
+    def __init__(self, persistence: Optional[PersistenceService] = None):
+        self.persistence = persistence
+
+        # Pending write operations, applied in order
+        self._ops: List[Tuple] = []
+        # Operations taken by a flush that is still writing them
+        self._applying: List[Tuple] = []
+        self._ops_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    @abstractmethod
+    def load(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Load last ``limit`` messages for user"""
+
+    @abstractmethod
+    def append(self, user_id: int, message: Dict[str, Any], window: List[Dict[str, Any]]):
+        """Persist a new message
+
+        ``window`` is the current in-memory history (already containing the
+        message) which backends may use to compact old entries.
+        """
+
+    @abstractmethod
+    def replace(self, user_id: int, messages: List[Dict[str, Any]]):
+        """Replace stored history for user"""
+
+    @abstractmethod
+    def _apply(self, ops: List[Tuple]):
+        """Write queued operations to disk"""
+
+    def _should_flush_inline(self) -> bool:
+        """Whether to flush immediately when no persistence service runs"""
+        return True
+
+    def _queue(self, op: Tuple):
+        """Queue write operation"""
+        with self._ops_lock:
+            self._ops.append(op)
+
+        if self.persistence and self.persistence.running:
+            self.persistence.mark_dirty(f'history:{id(self)}', self.flush)
+        elif self._should_flush_inline():
+            self.flush()
+
+    def flush(self):
+        """Apply pending operations (safe to call from any thread)"""
+        with self._io_lock:
+            with self._ops_lock:
+                ops, self._ops = self._ops, []
+                self._applying = list(ops)
+            try:
+                if ops:
+                    self._apply(ops)
+            except Exception:
+                # Keep what was not written for the next flush
+                with self._ops_lock:
+                    self._ops = self._applying + self._ops
+                raise
+            finally:
+                with self._ops_lock:
+                    self._applying = []
+
+    def forget(self, user_id: int):
+        """Drop per-user bookkeeping once the conversation left memory"""
+
+    def _pending_ops(self, user_id: int) -> List[Tuple]:
+        """Operations of user not yet on disk (being written or queued), in order"""
+        with self._ops_lock:
+            return [op for op in self._applying + self._ops if op[1] == user_id]
+
+    def close(self):
+        """Flush and release resources"""
+        self.flush()
+
+
+class JournalHistoryStorage(HistoryStorage):
+    """Append-only per-user JSONL journals
+
+    Every message is appended as one line to ``user_<id>.jsonl``. The journal
+    is compacted back to the current window once it grows past
+    ``compact_threshold`` lines, and a torn trailing line left by a crash is
+    skipped on replay. Each written operation leaves ``_applying`` right
+    away, so ``load()`` can read a journal without waiting for the flush.
+    """
+
+    # Write counters are kept per stripe of user ids
+    WRITE_STRIPES = 64
+
+    def __init__(
+        self,
+        history_dir: Path,
+        compact_threshold: int = 40,
+        persistence: Optional[PersistenceService] = None
+    ):
+        super().__init__(persistence)
+        self.history_dir = history_dir
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.compact_threshold = compact_threshold
+
+        # Number of lines in each user's journal once pending writes land
+        self._journal_lines: Dict[int, int] = {}
+
+        # User whose journal is being written, writes done per stripe
+        self._writing: Optional[int] = None
+        self._writes = [0] * self.WRITE_STRIPES
+
+    def _journal_file(self, user_id: int) -> Path:
+        """Get journal file path for user"""
+        return self.history_dir / f'user_{user_id}.jsonl'
+
+    def load(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Replay user journal (or legacy JSON file) plus writes not yet on disk"""
+        journal_file = self._journal_file(user_id)
+        legacy_file = self._legacy_file(user_id)
+        stripe = user_id % self.WRITE_STRIPES
+
+        # Read without waiting for the flush, again if the flusher wrote
+        # this journal meanwhile (pending ops would be applied twice)
+        while True:
+            with self._ops_lock:
+                pending = [op for op in self._applying + self._ops if op[1] == user_id]
+                writes = self._writes[stripe]
+
+            legacy = False
+            if journal_file.exists():
+                messages, lines, torn = read_journal(journal_file)
+            elif legacy_file.exists():
+                with open(legacy_file, 'r', encoding='utf-8') as f:
+                    messages = json.load(f)
+                lines, torn, legacy = 0, False, True
+            else:
+                messages, lines, torn = [], 0, False
+
+            with self._ops_lock:
+                if self._writes[stripe] == writes and self._writing != user_id:
+                    break
+            time.sleep(0.001)
+
+        for kind, _, payload in pending:
+            if kind == 'append':
+                messages.append(json.loads(payload))
+                lines += 1
+            elif kind == 'replace':
+                messages = [json.loads(line) for line in payload]
+                lines, torn, legacy = len(payload), False, False
+
+        messages = messages[-limit:]
+        self._journal_lines[user_id] = lines
+
+        if legacy:
+            # Migrate legacy file to journal format
+            self.replace(user_id, messages)
+            self._queue(('remove_legacy', user_id, None))
+        elif torn or lines > self.compact_threshold:
+            self.replace(user_id, messages)
+        return messages
+
+    def forget(self, user_id: int):
+        """Drop journal line count, load() counts the lines again"""
+        self._journal_lines.pop(user_id, None)
+
+    def _legacy_file(self, user_id: int) -> Path:
+        """Get pre-journal JSON history path for user"""
+        return self.history_dir / f'user_{user_id}.json'
+
+    def append(self, user_id: int, message: Dict[str, Any], window: List[Dict[str, Any]]):
+        """Append single message to user journal, compacting when too long"""
+        lines = self._journal_lines.get(user_id, 0) + 1
+        if lines > self.compact_threshold:
+            self.replace(user_id, window)
+            return
+
+        self._journal_lines[user_id] = lines
+        self._queue(('append', user_id, json.dumps(message, ensure_ascii=False)))
+
+    def replace(self, user_id: int, messages: List[Dict[str, Any]]):
+        """Rewrite user journal"""
+        self._journal_lines[user_id] = len(messages)
+        self._queue(('replace', user_id, [json.dumps(message, ensure_ascii=False) for message in messages]))
+
+    def _apply(self, ops: List[Tuple]):
+        """Append lines and atomically rewrite compacted journals"""
+        for kind, user_id, payload in ops:
+            with self._ops_lock:
+                self._writing = user_id
+            written = False
+            try:
+                self._write_op(kind, user_id, payload)
+                written = True
+            finally:
+                with self._ops_lock:
+                    self._writing = None
+                    self._writes[user_id % self.WRITE_STRIPES] += 1
+                    if written:
+                        # On disk now, load() must not replay it again
+                        del self._applying[0]
+
+    def _write_op(self, kind: str, user_id: int, payload):
+        """Write single queued operation to the user's files"""
+        journal_file = self._journal_file(user_id)
+        if kind == 'append':
+            with open(journal_file, 'a', encoding='utf-8') as f:
+                f.write(payload + '\n')
+        elif kind == 'remove_legacy':
+            self._legacy_file(user_id).unlink(missing_ok=True)
+        else:
+            tmp_file = journal_file.with_suffix('.jsonl.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for line in payload:
+                    f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, journal_file)
+
+
+class SQLiteHistoryStorage(HistoryStorage):
+    """All conversation histories in a single SQLite database (WAL mode)
+
+    Queued writes are applied in one transaction. Without a persistence
+    service they are committed every ``batch_size`` writes or
+    ``commit_interval`` seconds, whichever comes first. Rows older than the
+    in-memory window are pruned periodically.
+    """
+
+    def __init__(
+        self,
+        db_file: Path,
+        batch_size: int = 50,
+        commit_interval: float = 1.0,
+        prune_every: int = 20,
+        persistence: Optional[PersistenceService] = None
+    ):
+        super().__init__(persistence)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.prune_every = prune_every
+
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'user_id INTEGER NOT NULL, '
+            'seq INTEGER NOT NULL, '
+            'role TEXT NOT NULL, '
+            'parts TEXT NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_user_seq ON messages (user_id, seq)'
+        )
+        self.conn.commit()
+
+        # Reads go through their own connection so they never wait for a
+        # write transaction (WAL readers see the last commit)
+        self.read_conn = sqlite3.connect(str(db_file), check_same_thread=False)
+
+        # Next sequence number per user
+        self._next_seq: Dict[int, int] = {}
+
+        # Time of oldest queued write
+        self._first_pending_at: Optional[float] = None
+
+    def _get_next_seq(self, user_id: int) -> int:
+        """Get next sequence number for user"""
+        if user_id not in self._next_seq:
+            # Counter may have been forgotten while writes are still
+            # pending, they are taken before reading like in load()
+            last = 0
+            for kind, _, payload in self._pending_ops(user_id):
+                last = payload[0] if kind == 'append' else len(payload)
+            row = self.read_conn.execute(
+                'SELECT MAX(seq) FROM messages WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            self._next_seq[user_id] = max(row[0] or 0, last) + 1
+        return self._next_seq[user_id]
+
+    def forget(self, user_id: int):
+        """Drop sequence counter, it is read back from disk when needed"""
+        self._next_seq.pop(user_id, None)
+
+    def load(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Load last messages for user using (user_id, seq) index"""
+        # Taken before reading, so writes committed meanwhile are replayed
+        # over the same seq numbers instead of being missed
+        pending = self._pending_ops(user_id)
+        rows = self.read_conn.execute(
+            'SELECT seq, role, parts FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT ?',
+            (user_id, limit)
+        ).fetchall()
+
+        messages = {seq: (role, parts) for seq, role, parts in rows}
+        for kind, _, payload in pending:
+            if kind == 'append':
+                seq, role, parts, prune_below = payload
+                messages[seq] = (role, parts)
+                if prune_below is not None:
+                    messages = {key: value for key, value in messages.items() if key > prune_below}
+            else:
+                messages = {seq: (role, parts) for seq, role, parts in payload}
+
+        return [
+            {'role': role, 'parts': json.loads(parts)}
+            for role, parts in (messages[seq] for seq in sorted(messages)[-limit:])
+        ]
+
+    def append(self, user_id: int, message: Dict[str, Any], window: List[Dict[str, Any]]):
+        """Queue message insert"""
+        seq = self._get_next_seq(user_id)
+        self._next_seq[user_id] = seq + 1
+
+        # Drop rows that fell out of the window
+        prune_below = seq - len(window) if seq % self.prune_every == 0 else None
+
+        self._queue((
+            'append',
+            user_id,
+            (seq, message['role'], json.dumps(message['parts'], ensure_ascii=False), prune_below)
+        ))
+
+    def replace(self, user_id: int, messages: List[Dict[str, Any]]):
+        """Queue replacement of stored history"""
+        self._next_seq[user_id] = len(messages) + 1
+        self._queue((
+            'replace',
+            user_id,
+            [
+                (seq, message['role'], json.dumps(message['parts'], ensure_ascii=False))
+                for seq, message in enumerate(messages, 1)
+            ]
+        ))
+
+    def _should_flush_inline(self) -> bool:
+        """Commit when batch is full or old"""
+        now = time.monotonic()
+        if self._first_pending_at is None:
+            self._first_pending_at = now
+        return len(self._ops) >= self.batch_size or now - self._first_pending_at >= self.commit_interval
+
+    def _apply(self, ops: List[Tuple]):
+        """Apply queued writes in a single transaction"""
+        try:
+            for kind, user_id, payload in ops:
+                if kind == 'append':
+                    seq, role, parts, prune_below = payload
+                    self.conn.execute(
+                        'INSERT INTO messages (user_id, seq, role, parts) VALUES (?, ?, ?, ?)',
+                        (user_id, seq, role, parts)
+                    )
+                    if prune_below is not None:
+                        self.conn.execute(
+                            'DELETE FROM messages WHERE user_id = ? AND seq <= ?',
+                            (user_id, prune_below)
+                        )
+                else:
+                    self.conn.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+                    self.conn.executemany(
+                        'INSERT INTO messages (user_id, seq, role, parts) VALUES (?, ?, ?, ?)',
+                        [(user_id, seq, role, parts) for seq, role, parts in payload]
+                    )
+            self.conn.commit()
+        except Exception:
+            # Nothing of a failed batch may ride along with the next commit
+            self.conn.rollback()
+            raise
+        self._first_pending_at = None
+
+    def close(self):
+        """Commit and close database"""
+        self.flush()
+        self.read_conn.close()
+        self.conn.close()
+
+
+def read_journal(journal_file: Path) -> tuple[List[Dict[str, Any]], int, bool]:
+    """Read JSONL journal, returning messages, line count and torn flag"""
+    messages = []
+    lines = 0
+    torn = False
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            lines += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Partially written line after a crash
+                torn = True
+    return messages, lines, torn
+
+
+def migrate_json_history(history_dir: Path, storage: HistoryStorage, max_length: int) -> int:
+    """Import per-user JSON/JSONL history files into storage
+
+    Migrated files are moved to ``history_dir/migrated`` so the migration
+    runs only once. Returns number of migrated users.
+    """
+    migrated_dir = history_dir / 'migrated'
+    migrated = 0
+
+    for history_file in sorted(history_dir.glob('user_*.json*')):
+        if history_file.suffix not in ('.json', '.jsonl'):
+            continue
+        try:
+            user_id = int(history_file.stem.split('_', 1)[1])
+
+            if history_file.suffix == '.jsonl':
+                messages = read_journal(history_file)[0]
+            else:
+                with open(history_file, 'r', encoding='utf-8') as f:
+                    messages = json.load(f)
+
+            storage.replace(user_id, messages[-max_length:])
+
+            migrated_dir.mkdir(exist_ok=True)
+            history_file.rename(migrated_dir / history_file.name)
+            migrated += 1
+        except Exception as e:
+            print(f"Error migrating history file {history_file.name}: {e}")
+
+    storage.flush()
+    return migrated
+
+
+def create_history_storage(
+    backend: str,
+    history_dir: Path,
+    max_length: int,
+    persistence: Optional[PersistenceService] = None
+) -> HistoryStorage:
+    """Create history storage backend by name"""
+    history_dir.mkdir(parents=True, exist_ok=True)
+
+    if backend == 'journal':
+        return JournalHistoryStorage(history_dir, compact_threshold=max_length * 2, persistence=persistence)
+
+    storage = SQLiteHistoryStorage(history_dir / 'history.db', persistence=persistence)
+    migrated = migrate_json_history(history_dir, storage, max_length)
+    if migrated:
+        print(f"Migrated {migrated} history files to SQLite")
+    return storage
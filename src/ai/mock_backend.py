@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deterministic local LLM backend for offline load testing
+"""
+
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from src.ai.context import estimate_tokens
+from src.ai.gemini_client import GeminiClient
+
+
+# Words the mock replies are made of
+MOCK_WORDS = [
+    'да', 'норм', 'ща', 'ну', 'я', 'хз', 'ок', 'потом', 'расскажу', 'слушай',
+    'а', 'че', 'угу', 'не', 'ладно', 'кста', 'жиза', 'ты', 'опять', 'завтра',
+]
+
+
+@dataclass
+class MockSettings:
+    """Latency, throughput and error injection settings"""
+    latency_mean: float = 0.8        # seconds before the first token
+    latency_sigma: float = 0.4       # lognormal spread of that latency
+    tokens_per_second: float = 50.0  # generation speed after first token
+    error_rate: float = 0.0          # share of requests failing with 429/503
+    seed: Optional[int] = None       # fixed seed for reproducible runs
+
+
+class MockServiceError(Exception):
+    """Injected upstream error (looks like a quota or server error)"""
+
+    def __init__(self, code: int):
+        super().__init__(f"mock upstream error {code}")
+        self.code = code
+
+
+class MockUsage:
+    """Token usage in the shape of the SDK usage_metadata"""
+
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class MockResponse:
+    """Response or stream chunk with ``text`` and ``usage_metadata``"""
+
+    def __init__(self, text: str, usage: Optional[MockUsage] = None, chunks: Optional[List[str]] = None, delay: float = 0.0):
+        self.text = text
+        self.usage_metadata = usage
+        self._chunks = chunks or []
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        """Yield chunks paced by token rate, last one carries usage"""
+        for index, chunk in enumerate(self._chunks, 1):
+            await asyncio.sleep(self._delay)
+            yield MockResponse(chunk, self.usage_metadata if index == len(self._chunks) else None)
+
+
+class MockGenerativeModel:
+    """Stand-in for ``genai.GenerativeModel`` with simulated latency"""
+
+    def __init__(self, model_name: str, settings: MockSettings, rng: random.Random, **kwargs):
+        self.model_name = model_name
+        self.settings = settings
+        self.rng = rng
+        self.system_instruction = kwargs.get('system_instruction') or ''
+        generation_config = kwargs.get('generation_config')
+        self.max_output_tokens = getattr(generation_config, 'max_output_tokens', None) or 200
+
+    def start_chat(self, history: Optional[List[Any]] = None) -> 'MockChatSession':
+        """Start mock chat session"""
+        return MockChatSession(self, history)
+
+    async def generate_content_async(self, prompt: str, generation_config=None, stream: bool = False):
+        """Generate single response"""
+        max_tokens = getattr(generation_config, 'max_output_tokens', None) or self.max_output_tokens
+        return await self._generate(estimate_tokens(prompt), max_tokens, stream)
+
+    async def _generate(self, prompt_tokens: int, max_tokens: int, stream: bool) -> MockResponse:
+        """Sleep like a real model and build reply"""
+        settings = self.settings
+
+        if self.rng.random() < settings.error_rate:
+            await asyncio.sleep(self.rng.lognormvariate(0, settings.latency_sigma) * settings.latency_mean / 4)
+            raise MockServiceError(self.rng.choice([429, 503]))
+
+        # Time to first token, then fixed token rate
+        first_token = self.rng.lognormvariate(0, settings.latency_sigma) * settings.latency_mean
+        output_tokens = self.rng.randint(3, max(3, min(max_tokens, 40)))
+        words = [self.rng.choice(MOCK_WORDS) for _ in range(output_tokens)]
+        text = ' '.join(words)
+        per_token = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+        await asyncio.sleep(first_token)
+        usage = MockUsage(prompt_tokens + estimate_tokens(self.system_instruction), output_tokens)
+
+        if stream:
+            # Roughly 5 tokens per chunk, like the real stream
+            chunks = [' '.join(words[i:i + 5]) + ' ' for i in range(0, len(words), 5)]
+            return MockResponse(text, usage, chunks, per_token * 5)
+
+        await asyncio.sleep(per_token * output_tokens)
+        return MockResponse(text, usage)
+
+
+class MockChatSession:
+    """Stand-in for the SDK ChatSession"""
+
+    def __init__(self, model: MockGenerativeModel, history: Optional[List[Any]] = None):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, content: str, stream: bool = False) -> MockResponse:
+        """Send message and record both turns"""
+        prompt_tokens = estimate_tokens(content) + sum(
+            estimate_tokens(' '.join(message['parts'])) for message in self.history if isinstance(message, dict)
+        )
+        response = await self.model._generate(prompt_tokens, self.model.max_output_tokens, stream)
+
+        self.history.append({'role': 'user', 'parts': [content]})
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
+
+
+class MockBackend(GeminiClient):
+    """Full GeminiClient pipeline on top of simulated models
+
+    History, caching, rate limiting and routing behave exactly as with
+    Gemini, only the model calls are replaced, so handler throughput can be
+    benchmarked without network access.
+    """
+
+    def __init__(self, mock_settings: Optional[MockSettings] = None, **kwargs):
+        self.mock_settings = mock_settings or MockSettings()
+        self.mock_rng = random.Random(self.mock_settings.seed)
+        kwargs.setdefault('api_key', '')
+        super().__init__(model_factory=self._create_mock_model, **kwargs)
+
+    def _create_mock_model(self, model_name: str, **kwargs) -> MockGenerativeModel:
+        """Model factory passed to GeminiClient"""
+        return MockGenerativeModel(model_name, self.mock_settings, self.mock_rng, **kwargs)
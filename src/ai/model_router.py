@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Latency-aware routing between Gemini models with circuit breaker
+"""
+
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class ModelEndpoint:
+    """Single model with rolling latency/error window and breaker state"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, model: Any, window: int = 50):
+        self.name = name
+        self.model = model
+
+        # Rolling window of recent calls
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+        # Counters
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+
+    @property
+    def error_rate(self) -> float:
+        """Share of failed calls in window"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def p50(self) -> float:
+        """Median latency in window"""
+        return percentile(list(self.latencies), 50)
+
+    def p95(self) -> float:
+        """95th percentile latency in window"""
+        return percentile(list(self.latencies), 95)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get endpoint metrics"""
+        return {
+            'state': self.state,
+            'requests': self.requests,
+            'failures': self.failures,
+            'trips': self.trips,
+            'error_rate': self.error_rate,
+            'p50': self.p50(),
+            'p95': self.p95(),
+        }
+
+
+class ModelRouter:
+    """Pick the first healthy model from a preference-ordered pool
+
+    Each model has a circuit breaker: it opens when the rolling p95 latency
+    exceeds ``latency_threshold`` seconds or the error rate reaches
+    ``error_threshold`` (after ``min_samples`` calls). Open models get no
+    traffic for ``cooldown`` seconds, then one probe request decides
+    whether the breaker closes again. Callers must ``release()`` a chosen
+    endpoint once done so a probe that never reached the model (or whose
+    outcome was not recorded) does not block the endpoint forever.
+    """
+
+    def __init__(
+        self,
+        model_names: List[str],
+        create_model: Callable[[str], Any],
+        latency_threshold: float = 8.0,
+        error_threshold: float = 0.5,
+        min_samples: int = 5,
+        cooldown: float = 60.0,
+        window: int = 50
+    ):
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.create_model = create_model
+
+        self.endpoints: Dict[str, ModelEndpoint] = {}
+        for name in model_names:
+            self.endpoints[name] = ModelEndpoint(name, create_model(name), window)
+        self.window = window
+
+    def choose(self, preferred: Optional[str] = None) -> ModelEndpoint:
+        """Get endpoint for next request"""
+        if preferred and preferred not in self.endpoints:
+            self.endpoints[preferred] = ModelEndpoint(preferred, self.create_model(preferred), self.window)
+
+        candidates = list(self.endpoints.values())
+        if preferred:
+            candidates.sort(key=lambda endpoint: endpoint.name != preferred)
+
+        now = time.monotonic()
+        for endpoint in candidates:
+            if self._allow(endpoint, now):
+                return endpoint
+
+        # Everything is open: use the one that failed longest ago
+        return min(candidates, key=lambda endpoint: endpoint.opened_at)
+
+    def record(self, endpoint: ModelEndpoint, latency: float, ok: bool):
+        """Record call result and update breaker"""
+        endpoint.requests += 1
+        endpoint.outcomes.append(ok)
+        if ok:
+            endpoint.latencies.append(latency)
+        else:
+            endpoint.failures += 1
+
+        if endpoint.state == ModelEndpoint.HALF_OPEN:
+            endpoint.probe_in_flight = False
+            if ok and latency < self.latency_threshold:
+                endpoint.state = ModelEndpoint.CLOSED
+                endpoint.latencies.clear()
+                endpoint.outcomes.clear()
+            else:
+                self._trip(endpoint)
+            return
+
+        if endpoint.state == ModelEndpoint.CLOSED and len(endpoint.outcomes) >= self.min_samples:
+            if endpoint.error_rate >= self.error_threshold or endpoint.p95() >= self.latency_threshold:
+                self._trip(endpoint)
+
+    def release(self, endpoint: ModelEndpoint):
+        """Free probe slot of endpoint whose request ended without a recorded outcome"""
+        if endpoint.state == ModelEndpoint.HALF_OPEN:
+            endpoint.probe_in_flight = False
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get metrics for every model"""
+        return {name: endpoint.get_stats() for name, endpoint in self.endpoints.items()}
+
+    def _allow(self, endpoint: ModelEndpoint, now: float) -> bool:
+        """Check if endpoint may take a request"""
+        if endpoint.state == ModelEndpoint.CLOSED:
+            return True
+
+        if endpoint.state == ModelEndpoint.OPEN and now - endpoint.opened_at >= self.cooldown:
+            endpoint.state = ModelEndpoint.HALF_OPEN
+
+        if endpoint.state == ModelEndpoint.HALF_OPEN and not endpoint.probe_in_flight:
+            endpoint.probe_in_flight = True
+            return True
+
+        return False
+
+    def _trip(self, endpoint: ModelEndpoint):
+        """Open breaker"""
+        endpoint.state = ModelEndpoint.OPEN
+        endpoint.opened_at = time.monotonic()
+        endpoint.trips += 1
+        print(f"Model {endpoint.name} degraded (p95 {endpoint.p95():.1f}s, errors {endpoint.error_rate:.0%}), routing to fallback")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client-side rate limiter for Gemini quota
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from src.core.metrics import TimingStat
+
+
+# Request priorities (lower value is served first)
+PRIORITY_HIGH = 0     # commands and first replies
+PRIORITY_NORMAL = 1   # regular chat turns
+PRIORITY_LOW = 2      # background work like summaries
+
+# HTTP codes and exception names worth retrying
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {
+    'ResourceExhausted',
+    'TooManyRequests',
+    'ServiceUnavailable',
+    'InternalServerError',
+    'DeadlineExceeded',
+}
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check if error is a quota (429) or server (5xx) error"""
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    try:
+        return int(getattr(error, 'code', 0)) in RETRYABLE_CODES
+    except (TypeError, ValueError):
+        return False
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Check if error means we exceeded quota"""
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    try:
+        return int(getattr(error, 'code', 0)) == 429
+    except (TypeError, ValueError):
+        return False
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponential backoff with jitter"""
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously
+
+    Holds a minute's worth of tokens unless a smaller ``capacity`` (burst
+    size) is given.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = per_minute if capacity is None else capacity
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        """Add tokens for elapsed time"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Take tokens (may go negative to account for underestimates)"""
+        self._refill()
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute limiter with a priority queue
+
+    ``acquire()`` waits until both buckets allow the request. Waiting
+    requests are served strictly by priority, then in arrival order.
+    ``pause()`` stops all dispatching for a while after a quota error.
+    """
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 32000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+        # Heap of (priority, seq, tokens, future)
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+        # Metrics
+        self.queue_wait = TimingStat()
+        self.throttled = 0
+        self.pauses = 0
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_NORMAL):
+        """Wait for permission to send request of ``tokens`` estimated tokens"""
+        self._ensure_dispatcher()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), tokens, future))
+        self._wakeup.set()
+
+        queued_at = time.monotonic()
+        try:
+            await future
+        finally:
+            if not future.done():
+                future.cancel()
+        wait = time.monotonic() - queued_at
+        self.queue_wait.record(wait)
+        if wait > 0.01:
+            self.throttled += 1
+
+    def record_usage(self, estimated: int, actual: int):
+        """Correct token bucket once real usage is known"""
+        self.tokens.consume(actual - estimated)
+
+    def pause(self, seconds: float):
+        """Stop dispatching for ``seconds`` (after quota errors)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.pauses += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get limiter counters"""
+        return {
+            'queued': len(self._queue),
+            'throttled': self.throttled,
+            'pauses': self.pauses,
+            'queue_wait': self.queue_wait.get_stats(),
+        }
+
+    def _ensure_dispatcher(self):
+        """Start dispatcher task on first use"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """Release queued requests as quota allows"""
+        while True:
+            # Drop requests whose callers went away
+            while self._queue and self._queue[0][3].done():
+                heapq.heappop(self._queue)
+
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            _, _, tokens, future = self._queue[0]
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self.requests.time_until(1),
+                self.tokens.time_until(tokens),
+            )
+
+            if delay <= 0:
+                heapq.heappop(self._queue)
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+                future.set_result(None)
+                continue
+
+            # Sleep, but wake up early if a higher priority request arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
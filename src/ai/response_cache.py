@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache of AI replies for short, frequent messages
+"""
+
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.cache import LRUCache
+
+
+# Everything except letters, digits and spaces
+NON_WORD = re.compile(r'[^\w\s]|_')
+# Same character repeated 3+ times ("привееет")
+REPEATS = re.compile(r'(\w)\1{2,}')
+
+
+def normalize_message(text: str) -> str:
+    """Normalize message text for cache lookup"""
+    text = text.lower().replace('ё', 'е')
+    text = NON_WORD.sub(' ', text)
+    text = REPEATS.sub(r'\1', text)
+    return ' '.join(text.split())
+
+
+class ResponseCache:
+    """Reuse replies to short messages like "привет" or "как дела"
+
+    Entries are keyed on normalized text, personality key and a coarse
+    fingerprint of the conversation (stage, whether the model's last reply
+    asked something, the intent of the previous user message), so a reply
+    is shared between users whose chats are at a similar point. Up to ``variants`` different replies are collected per key
+    before the cache starts answering, and a random one is picked on each
+    hit so replies don't look canned.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1000,
+        variants: int = 3,
+        max_message_length: int = 30
+    ):
+        self.ttl = ttl
+        self.variants = variants
+        self.max_message_length = max_message_length
+
+        # key -> {'created': timestamp, 'replies': [...]}
+        self.entries = LRUCache(capacity=max_entries)
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message: str, personality: str, history: List[Dict[str, Any]]) -> Optional[str]:
+        """Get cached reply to message following history, or None"""
+        key = self._make_key(message, personality, history)
+        if key is None:
+            return None
+
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry['created'] > self.ttl:
+            self.entries.pop(key)
+            entry = None
+
+        # Keep asking the model until enough variants are collected
+        if entry is None or len(entry['replies']) < self.variants:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return random.choice(entry['replies'])
+
+    def put(self, message: str, personality: str, history: List[Dict[str, Any]], reply: str):
+        """Store reply as a variant for message following history"""
+        key = self._make_key(message, personality, history)
+        if key is None or not reply:
+            return
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {'created': time.monotonic(), 'replies': []}
+            self.entries.set(key, entry)
+
+        if reply not in entry['replies'] and len(entry['replies']) < self.variants:
+            entry['replies'].append(reply)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache hit counters"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _make_key(self, message: str, personality: str, history: List[Dict[str, Any]]) -> Optional[Tuple]:
+        """Build cache key, None if message is not cacheable"""
+        if len(message) > self.max_message_length:
+            return None
+
+        normalized = normalize_message(message)
+        if not normalized:
+            return None
+
+        # Coarse conversation stage instead of exact history
+        if not history:
+            stage = 'new'
+        elif len(history) < 6:
+            stage = 'short'
+        else:
+            stage = 'long'
+
+        # What the reply answers besides the message itself
+        last_reply = next((m for m in reversed(history) if m.get('role') == 'model'), None)
+        asked = bool(last_reply) and '?' in ' '.join(last_reply['parts'])
+
+        return normalized, personality, stage, asked, self._last_intent(history)
+
+    def _last_intent(self, history: List[Dict[str, Any]]) -> str:
+        """Coarse intent of previous user message: the text itself if short"""
+        last_message = next((m for m in reversed(history) if m.get('role') == 'user'), None)
+        if last_message is None:
+            return ''
+
+        text = ' '.join(last_message['parts'])
+        if len(text) <= self.max_message_length:
+            return normalize_message(text)
+        return 'question' if '?' in text else 'statement'
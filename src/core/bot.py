@@ -10,8 +10,16 @@ from pathlib import Path
 
 from src.utils.config import get_config
 from src.utils.logger import get_logger, print_logo
-from src.ai.gemini_client import GeminiClient
+from src.ai.backend import create_backend
+from src.ai.rate_limiter import RateLimiter
+from src.ai.response_cache import ResponseCache
 from src.core.stats import Statistics
+from src.core.timeseries import TimeSeriesStore
+from src.core.dispatcher import WorkDispatcher
+from src.core.outbound import OutboundQueue
+from src.core.metrics import PipelineMetrics
+from src.core.exporter import MetricsExporter
+from src.core.persistence import get_persistence
 from src.handlers.commands import CommandHandler
 from src.handlers.message_handler import MessageHandler
 from src.core.version import get_version, get_version_info
@@ -31,22 +39,72 @@ class GirlfriendBot:
         # Initialize Telegram client
         self.client = None
 
+        # Background disk writer
+        self.persistence = get_persistence()
+        self.persistence.flush_interval = self.config.PERSIST_FLUSH_INTERVAL
+        self.persistence.max_dirty = self.config.PERSIST_MAX_DIRTY
+
         # Initialize AI client
-        self.ai_client = GeminiClient(
-            api_key=self.config.GEMINI_API_KEY,
+        self.ai_client = create_backend(
+            self.config,
             data_dir=self.config.DATA_DIR,
-            max_history_length=self.config.MAX_HISTORY_LENGTH
+            max_history_length=self.config.MAX_HISTORY_LENGTH,
+            history_backend=self.config.HISTORY_BACKEND,
+            history_cache_size=self.config.HISTORY_CACHE_SIZE,
+            history_cache_max_bytes=int(self.config.HISTORY_CACHE_MAX_MB * 1024 * 1024),
+            history_cache_idle_ttl=self.config.HISTORY_CACHE_TTL,
+            history_token_budget=self.config.HISTORY_TOKEN_BUDGET,
+            summary_stale_turns=self.config.SUMMARY_STALE_TURNS,
+            enable_summary=self.config.ENABLE_HISTORY_SUMMARY,
+            chat_session_pool_size=self.config.CHAT_SESSION_POOL_SIZE,
+            llm_max_concurrency=self.config.LLM_MAX_CONCURRENCY,
+            response_cache=self._create_response_cache(),
+            rate_limiter=RateLimiter(
+                requests_per_minute=self.config.LLM_REQUESTS_PER_MINUTE,
+                tokens_per_minute=self.config.LLM_TOKENS_PER_MINUTE
+            ),
+            max_retries=self.config.LLM_MAX_RETRIES,
+            retry_base_delay=self.config.LLM_RETRY_BASE_DELAY,
+            models=self.config.GEMINI_MODELS,
+            router_latency_threshold=self.config.ROUTER_LATENCY_P95,
+            router_error_threshold=self.config.ROUTER_ERROR_RATE,
+            router_cooldown=self.config.ROUTER_COOLDOWN,
+            personalities=self.config.personalities
         )
 
         # Initialize statistics
-        self.stats = Statistics(self.config.DATA_DIR)
+        self.stats = Statistics(
+            self.config.DATA_DIR,
+            flush_interval=self.config.STATS_FLUSH_INTERVAL,
+            flush_every=self.config.STATS_FLUSH_EVERY,
+            timeseries=TimeSeriesStore(
+                self.config.DATA_DIR / 'statistics.db',
+                hourly_retention_days=self.config.STATS_HOURLY_RETENTION_DAYS,
+                daily_retention_days=self.config.STATS_DAILY_RETENTION_DAYS
+            )
+        )
+
+        # Latency of message pipeline stages
+        self.perf = PipelineMetrics()
 
         # Initialize command handler
         self.command_handler = CommandHandler(
             config=self.config,
             ai_client=self.ai_client,
             stats=self.stats,
-            logger=self.logger
+            logger=self.logger,
+            perf=self.perf
+        )
+
+        # Ordered per-user queues on a fixed worker pool
+        self.dispatcher = WorkDispatcher(workers=self.config.MESSAGE_WORKERS)
+
+        # Single paced queue for everything sent to Telegram
+        self.outbound = OutboundQueue(
+            global_per_second=self.config.SEND_GLOBAL_PER_SECOND,
+            chat_interval=self.config.SEND_CHAT_INTERVAL,
+            max_retries=self.config.SEND_MAX_RETRIES,
+            max_flood_wait=self.config.SEND_MAX_FLOOD_WAIT
         )
 
         # Initialize message handler
@@ -55,7 +113,43 @@ class GirlfriendBot:
             ai_client=self.ai_client,
             stats=self.stats,
             command_handler=self.command_handler,
-            logger=self.logger
+            logger=self.logger,
+            dispatcher=self.dispatcher,
+            outbound=self.outbound,
+            perf=self.perf
+        )
+
+        # Drop expired sender entities in the background
+        self.persistence.add_periodic(self.message_handler.senders.evict_idle, 60.0)
+
+        # Optional Prometheus endpoint
+        self.exporter = self._create_exporter()
+
+    def _create_exporter(self):
+        """Create metrics exporter if enabled"""
+        if not self.config.ENABLE_METRICS:
+            return None
+
+        return MetricsExporter(
+            stats=self.stats,
+            perf=self.perf,
+            ai_client=self.ai_client,
+            dispatcher=self.dispatcher,
+            outbound=self.outbound,
+            message_handler=self.message_handler,
+            host=self.config.METRICS_HOST,
+            port=self.config.METRICS_PORT
+        )
+
+    def _create_response_cache(self):
+        """Create response cache if enabled"""
+        if not self.config.ENABLE_RESPONSE_CACHE:
+            return None
+
+        return ResponseCache(
+            ttl=self.config.RESPONSE_CACHE_TTL,
+            max_entries=self.config.RESPONSE_CACHE_SIZE,
+            variants=self.config.RESPONSE_CACHE_VARIANTS
         )
 
     def _check_config(self):
@@ -83,6 +177,19 @@ class GirlfriendBot:
         version_info = get_version_info()
         self.logger.info(f"Запуск {version_info['title']} v{get_version()}")
 
+        # Start background writes, message workers and send queue
+        await self.persistence.start()
+        await self.stats.start()
+        await self.dispatcher.start()
+        await self.outbound.start()
+
+        if self.exporter:
+            try:
+                await self.exporter.start()
+                self.logger.info(f"Метрики: http://{self.exporter.host}:{self.exporter.port}/metrics")
+            except OSError as e:
+                self.logger.error(f"Не удалось запустить метрики на порту {self.config.METRICS_PORT}: {e}")
+
         # Initialize Telegram client
         self.logger.info("Инициализация Telegram клиента (userbot)...")
         self.client = TelegramClient(
@@ -105,12 +212,14 @@ class GirlfriendBot:
         username = f"@{me.username}" if me.username else me.phone
         self.logger.success(f"Работаю как: {username} ({me.first_name})")
 
-        # Register event handlers
-        @self.client.on(events.NewMessage(incoming=True))
+        # Register event handlers (ignored users are dropped before any work)
+        @self.client.on(events.NewMessage(
+            incoming=True,
+            func=lambda event: event.is_private and not self.config.is_user_ignored(event.sender_id)
+        ))
         async def handle_new_message(event):
             """Handle new incoming messages"""
-            if event.is_private:
-                await self.message_handler.handle_message(event, self.client)
+            self.message_handler.dispatch(event, self.client)
 
         # Show ready message
         print("\n" + "="*60)
@@ -128,3 +237,14 @@ class GirlfriendBot:
             self.logger.info("Остановка бота...")
             await self.client.disconnect()
             self.logger.success("Бот остановлен")
+
+        if self.exporter:
+            await self.exporter.stop()
+
+        # Stop workers and drain pending writes
+        await self.dispatcher.stop()
+        await self.outbound.stop()
+        await self.stats.stop()
+        await self.persistence.stop()
+        self.stats.close()
+        self.ai_client.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-user ordered work queues served by a fixed worker pool
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from src.core.metrics import TimingStat
+
+
+class WorkDispatcher:
+    """Run jobs in strict order per key on ``workers`` shared workers
+
+    Every key (user) has its own FIFO queue and at most one job of a key
+    runs at a time. Keys with pending work wait in a round-robin ready
+    queue: a worker takes one job of the first key and puts the key back at
+    the end if it still has work, so a chatty user can't starve others.
+    """
+
+    def __init__(self, workers: int = 16):
+        self.workers = max(1, workers)
+
+        # key -> queue of (enqueued_at, job)
+        self._queues: Dict[Hashable, Deque[Tuple[float, Callable[[], Awaitable[Any]]]]] = {}
+        # Keys with pending jobs and no job running
+        self._ready: Deque[Hashable] = deque()
+        self._ready_event: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # Metrics
+        self.queue_wait = TimingStat()
+        self.queued = 0
+        self.busy = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    @property
+    def running(self) -> bool:
+        """Check if workers are running"""
+        return any(not task.done() for task in self._tasks)
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]):
+        """Queue coroutine function ``job`` after earlier jobs of ``key``"""
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.append(key)
+            if self._ready_event is not None:
+                self._ready_event.set()
+
+        queue.append((time.monotonic(), job))
+        self.queued += 1
+        self.max_depth = max(self.max_depth, len(queue))
+
+    def depth(self, key: Hashable) -> int:
+        """Number of jobs queued or running for key"""
+        queue = self._queues.get(key)
+        return len(queue) if queue is not None else 0
+
+    async def start(self):
+        """Start worker tasks"""
+        if self.running:
+            return
+        self._ready_event = asyncio.Event()
+        if self._ready:
+            self._ready_event.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel workers, dropping queued jobs"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues.clear()
+        self._ready.clear()
+        self.queued = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and wait times"""
+        return {
+            'workers': self.workers,
+            'busy': self.busy,
+            'queued': self.queued,
+            'users': len(self._queues),
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'errors': self.errors,
+            'queue_wait': self.queue_wait.get_stats(),
+        }
+
+    async def _worker(self):
+        """Take one job of the next ready key at a time"""
+        while True:
+            if not self._ready:
+                self._ready_event.clear()
+                await self._ready_event.wait()
+                continue
+
+            key = self._ready.popleft()
+            queue = self._queues[key]
+            enqueued_at, job = queue[0]
+            self.queued -= 1
+            self.queue_wait.record(time.monotonic() - enqueued_at)
+
+            self.busy += 1
+            try:
+                await job()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in queued job for {key}: {e}")
+            finally:
+                self.busy -= 1
+                self.processed += 1
+
+                # Job stays in queue while running so depth() counts it
+                queue.popleft()
+                if queue:
+                    self._ready.append(key)
+                    self._ready_event.set()
+                else:
+                    del self._queues[key]
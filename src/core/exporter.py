@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus metrics endpoint for bot internals
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.core.metrics import LatencyHistogram
+
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metric name prefix
+PREFIX = 'girlfriend_'
+
+# Event loop lag buckets (seconds)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+def _format_value(value: float) -> str:
+    """Format sample value"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _format_labels(labels: Optional[Dict[str, Any]]) -> str:
+    """Format label set, escaping values"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class MetricsWriter:
+    """Builds Prometheus text exposition"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Optional[Dict[str, Any]], float]]):
+        """Write metric family with (labels, value) samples"""
+        name = PREFIX + name
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            self.lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    def counter(self, name: str, help_text: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        """Write single counter sample"""
+        self.metric(name, 'counter', help_text, [(labels, value)])
+
+    def gauge(self, name: str, help_text: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        """Write single gauge sample"""
+        self.metric(name, 'gauge', help_text, [(labels, value)])
+
+    def histograms(self, name: str, help_text: str, histograms: Iterable[Tuple[Dict[str, Any], LatencyHistogram]]):
+        """Write histogram family with cumulative buckets"""
+        name = PREFIX + name
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                self.lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            if histogram.buckets[-1] != float('inf'):
+                self.lines.append(f'{name}_bucket{_format_labels(dict(labels, le="+Inf"))} {histogram.count}')
+            self.lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}')
+            self.lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+    def render(self) -> str:
+        """Get exposition text"""
+        return '\n'.join(self.lines) + '\n'
+
+
+def read_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, None if unknown"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak RSS as a fallback: kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class MetricsExporter:
+    """Serves ``GET /metrics`` in Prometheus text format
+
+    The server runs on the bot's event loop with ``asyncio.start_server``
+    and only reads in-memory counters, so a scrape never waits on disk or
+    the network. A probe task measures event loop lag: how late a short
+    sleep wakes up.
+    """
+
+    def __init__(
+        self,
+        stats,
+        perf,
+        ai_client,
+        dispatcher,
+        outbound,
+        message_handler,
+        host: str = '127.0.0.1',
+        port: int = 9464,
+        lag_interval: float = 0.5,
+        read_timeout: float = 5.0
+    ):
+        self.stats = stats
+        self.perf = perf
+        self.ai_client = ai_client
+        self.dispatcher = dispatcher
+        self.outbound = outbound
+        self.message_handler = message_handler
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.read_timeout = read_timeout
+
+        self.loop_lag = LatencyHistogram(LAG_BUCKETS)
+        self.scrapes = 0
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    async def start(self):
+        """Start HTTP server and lag probe"""
+        if self._server is not None:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._lag_task = asyncio.create_task(self._probe_lag())
+
+    async def stop(self):
+        """Stop lag probe and close server"""
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def render(self) -> str:
+        """Collect all metrics as exposition text"""
+        writer = MetricsWriter()
+        self._write_statistics(writer)
+        self._write_queues(writer)
+        self._write_llm(writer)
+        self._write_caches(writer)
+        self._write_process(writer)
+        return writer.render()
+
+    def _write_statistics(self, writer: MetricsWriter):
+        """Message, command, shedding and token counters"""
+        stats = self.stats
+        writer.counter('messages_received_total', 'Messages received', stats.total_messages_received)
+        writer.counter('messages_sent_total', 'Messages sent', stats.total_messages_sent)
+        writer.gauge('users', 'Users seen', len(stats.user_stats))
+        writer.metric('personality_messages_total', 'counter', 'Messages answered per personality', [
+            ({'personality': name}, count) for name, count in sorted(stats.personality_usage.items())
+        ])
+        writer.metric('commands_total', 'counter', 'Commands handled', [
+            ({'command': name}, count) for name, count in sorted(stats.command_usage.items())
+        ])
+        writer.metric('shed_total', 'counter', 'Answers degraded under overload', [
+            ({'reason': reason}, count) for reason, count in sorted(stats.shed_counts.items())
+        ])
+        writer.counter('deferred_total', 'Answers deferred under overload', stats.deferred_count)
+
+        cost = stats.cost_total
+        writer.counter('answers_total', 'AI answers', cost['requests'])
+        writer.counter('answers_cached_total', 'AI answers served from response cache', cost['cached'])
+        writer.metric('llm_tokens_total', 'counter', 'LLM tokens used', [
+            ({'personality': name, 'direction': direction}, personality_cost[f'{direction}_tokens'])
+            for name, personality_cost in sorted(stats.personality_cost.items())
+            for direction in ('input', 'output')
+        ])
+
+    def _write_queues(self, writer: MetricsWriter):
+        """Requests queued and in flight at every stage"""
+        handler = self.message_handler
+        writer.gauge('answers_pending', 'AI answers queued or running', handler.pending_answers)
+        writer.gauge('overloaded', 'Whether load shedding is active', handler.overloaded)
+
+        dispatcher = self.dispatcher.get_stats()
+        writer.gauge('dispatcher_busy_workers', 'Message workers running a job', dispatcher['busy'])
+        writer.gauge('dispatcher_queued', 'Messages waiting for a worker', dispatcher['queued'])
+        writer.counter('dispatcher_errors_total', 'Message jobs that raised', dispatcher['errors'])
+
+        outbound = self.outbound.get_stats()
+        writer.gauge('outbound_queued', 'Telegram calls queued or running', outbound['queued'])
+        writer.gauge('outbound_in_flight', 'Telegram calls running', outbound['in_flight'])
+        writer.counter('outbound_sent_total', 'Messages sent to Telegram', outbound['sent'])
+        writer.counter('outbound_edits_total', 'Messages edited in Telegram', outbound['edits'])
+        writer.counter('outbound_flood_waits_total', 'Flood waits received', outbound['flood_waits'])
+        writer.counter('outbound_failures_total', 'Telegram calls failed for good', outbound['failures'])
+
+    def _write_llm(self, writer: MetricsWriter):
+        """LLM concurrency, per-model counters and stage latency histograms"""
+        get_llm_stats = getattr(self.ai_client, 'get_llm_stats', None)
+        if get_llm_stats:
+            llm = get_llm_stats()
+            writer.gauge('llm_in_flight', 'LLM calls running', llm['in_flight'])
+            writer.gauge('llm_waiting', 'LLM calls waiting for a concurrency slot', llm['waiting'])
+            writer.gauge('llm_rate_limited', 'LLM calls waiting for the rate limiter', llm['rate_limiter']['queued'])
+            writer.counter('llm_retries_total', 'LLM call retries', llm['retries'])
+
+        get_router_stats = getattr(self.ai_client, 'get_router_stats', None)
+        if get_router_stats:
+            models = sorted(get_router_stats().items())
+            writer.metric('model_requests_total', 'counter', 'LLM calls per model', [
+                ({'model': name}, model['requests']) for name, model in models
+            ])
+            writer.metric('model_failures_total', 'counter', 'Failed LLM calls per model', [
+                ({'model': name}, model['failures']) for name, model in models
+            ])
+            writer.metric('model_breaker_open', 'gauge', 'Whether model circuit breaker is not closed', [
+                ({'model': name}, model['state'] != 'closed') for name, model in models
+            ])
+
+        writer.histograms('stage_duration_seconds', 'Message pipeline stage latency', [
+            ({'stage': stage}, histogram) for stage, histogram in self.perf.stages.items()
+        ])
+
+    def _write_caches(self, writer: MetricsWriter):
+        """Hits, misses and size of every cache"""
+        caches = {'senders': self.message_handler.senders.get_stats()}
+        history = getattr(self.ai_client, 'history', None)
+        if history is not None:
+            caches['history'] = history.get_cache_stats()
+        if hasattr(self.ai_client, 'get_session_stats'):
+            caches['sessions'] = self.ai_client.get_session_stats()
+        if getattr(self.ai_client, 'response_cache', None) is not None:
+            caches['responses'] = self.ai_client.response_cache.get_stats()
+
+        caches = sorted(caches.items())
+        writer.metric('cache_hits_total', 'counter', 'Cache hits', [
+            ({'cache': name}, cache['hits']) for name, cache in caches
+        ])
+        writer.metric('cache_misses_total', 'counter', 'Cache misses', [
+            ({'cache': name}, cache['misses']) for name, cache in caches
+        ])
+        writer.metric('cache_entries', 'gauge', 'Cache entries', [
+            ({'cache': name}, cache['size']) for name, cache in caches
+        ])
+
+    def _write_process(self, writer: MetricsWriter):
+        """Event loop lag and memory"""
+        writer.histograms('event_loop_lag_seconds', 'How late the event loop runs scheduled callbacks', [
+            ({}, self.loop_lag)
+        ])
+        rss = read_rss_bytes()
+        if rss is not None:
+            writer.gauge('process_resident_memory_bytes', 'Resident memory size', rss)
+        writer.counter('metrics_scrapes_total', 'Metrics requests served', self.scrapes)
+
+    async def _probe_lag(self):
+        """Measure how late short sleeps wake up"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.record(max(0.0, loop.time() - started - self.lag_interval))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer one HTTP request"""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=self.read_timeout)
+            method, path = (request.split(b'\r\n', 1)[0].decode('latin-1').split(' ') + ['', ''])[:2]
+
+            if method not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', 'method not allowed\n'
+            elif path.split('?', 1)[0] != '/metrics':
+                status, body = '404 Not Found', 'not found\n'
+            else:
+                self.scrapes += 1
+                status, body = '200 OK', self.render()
+
+            payload = body.encode('utf-8')
+            headers = (
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(payload)}\r\n'
+                'Connection: close\r\n\r\n'
+            )
+            writer.write(headers.encode('latin-1') + (payload if method != 'HEAD' else b''))
+            await writer.drain()
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lightweight in-memory metrics
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple
+
+
+class TimingStat:
+    """Running count, total and maximum of durations (seconds)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds: float):
+        """Record single duration"""
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get aggregated values"""
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'last': self.last,
+        }
+
+
+# Histogram bucket upper bounds (seconds), last one catches everything
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'),
+)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with interpolated percentiles
+
+    Recording is a binary search and one increment, memory does not grow
+    with the number of samples.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """Record single duration"""
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Estimate percentile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+
+        rank = pct / 100.0 * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = min(self.buckets[index], self.max)
+                if upper <= lower:
+                    return upper
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get count, average and percentiles"""
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class ThroughputCounter:
+    """Events per second over a rolling window of one-second slots"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.slots = [0] * window
+        self.slot_times = [0] * window
+        self.total = 0
+
+    def record(self, count: int = 1):
+        """Count events happening now"""
+        now = int(time.monotonic())
+        index = now % self.window
+        if self.slot_times[index] != now:
+            self.slot_times[index] = now
+            self.slots[index] = 0
+        self.slots[index] += count
+        self.total += count
+
+    def rate(self) -> float:
+        """Average events per second over the window"""
+        now = int(time.monotonic())
+        recent = sum(
+            count for count, at in zip(self.slots, self.slot_times)
+            if now - at < self.window
+        )
+        return recent / self.window
+
+
+class PipelineMetrics:
+    """Latency histograms per message pipeline stage plus throughput"""
+
+    # Stages in pipeline order
+    STAGES = ('sender', 'stats', 'history', 'llm_queue', 'llm_call', 'typing', 'send', 'total')
+
+    def __init__(self, window: int = 60):
+        self.stages: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.received = ThroughputCounter(window)
+        self.replied = ThroughputCounter(window)
+
+    def observe(self, stage: str, seconds: float):
+        """Record duration of stage"""
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = LatencyHistogram()
+        histogram.record(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Time block as stage"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get stage percentiles and throughput"""
+        return {
+            'stages': {stage: histogram.get_stats() for stage, histogram in self.stages.items()},
+            'received_per_second': self.received.rate(),
+            'replied_per_second': self.replied.rate(),
+            'received_total': self.received.total,
+            'replied_total': self.replied.total,
+        }
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rate-limited outbound queue for Telegram sends and edits
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+from src.ai.rate_limiter import TokenBucket, backoff_delay
+from src.core.metrics import TimingStat
+
+
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into chunks of at most ``limit`` chars on paragraph, line or word boundaries"""
+    chunks = []
+    text = text.strip()
+    while len(text) > limit:
+        cut = -1
+        for separator in ('\n\n', '\n', '. ', ' '):
+            cut = text.rfind(separator, 0, limit)
+            if cut > limit // 2:
+                cut += len(separator)
+                break
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].strip())
+        text = text[cut:].strip()
+
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class OutboundQueue:
+    """Single queue in front of all Telethon sends
+
+    Calls are queued per chat and run in order. A chat gets at most one
+    call every ``chat_interval`` seconds and all chats together at most
+    ``global_per_second`` calls per second. ``FloodWaitError`` blocks only
+    the affected chat for the requested time and the call is retried.
+    Other errors are retried only for idempotent calls (edits): a failed
+    send may still have been delivered, so it is not sent twice.
+    """
+
+    def __init__(
+        self,
+        global_per_second: float = 10.0,
+        chat_interval: float = 1.0,
+        max_retries: int = 3,
+        max_flood_wait: float = 300.0,
+        max_length: int = MAX_MESSAGE_LENGTH
+    ):
+        # Burst of at most one second of sends
+        self.bucket = TokenBucket(global_per_second * 60, capacity=max(1.0, global_per_second))
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.max_length = max_length
+
+        # chat_id -> queue of pending calls
+        self._chats: Dict[int, Deque[Dict[str, Any]]] = {}
+        # Chats with pending calls and none running, round-robin order
+        self._ready: Deque[int] = deque()
+        self._busy: Set[int] = set()
+        # chat_id -> earliest time of next call
+        self._next_at: Dict[int, float] = {}
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Calls in progress, one per busy chat
+        self._calls: Set[asyncio.Task] = set()
+
+        # Metrics
+        self.queue_wait = TimingStat()
+        self.queued = 0
+        self.sent = 0
+        self.edits = 0
+        self.split_messages = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.retries = 0
+        self.failures = 0
+
+    async def reply(self, event, text: str):
+        """Reply to event, sending long text as several paced messages; returns first message"""
+        chunks = split_message(text, self.max_length)
+        if len(chunks) > 1:
+            self.split_messages += 1
+
+        futures = [self._submit(event.chat_id, lambda chunk=chunks[0]: event.reply(chunk), False)]
+        for chunk in chunks[1:]:
+            futures.append(self._submit(event.chat_id, lambda chunk=chunk: event.respond(chunk), False))
+
+        results = await asyncio.gather(*futures)
+        self.sent += len(chunks)
+        return results[0]
+
+    async def respond(self, event, text: str):
+        """Send text to event's chat without reply; returns first message"""
+        chunks = split_message(text, self.max_length)
+        if len(chunks) > 1:
+            self.split_messages += 1
+
+        futures = [
+            self._submit(event.chat_id, lambda chunk=chunk: event.respond(chunk), False)
+            for chunk in chunks
+        ]
+        results = await asyncio.gather(*futures)
+        self.sent += len(chunks)
+        return results[0]
+
+    async def edit(self, message, text: str):
+        """Edit sent message (retried on errors, unchanged text counts as success)"""
+        async def call():
+            try:
+                return await message.edit(text[:self.max_length])
+            except MessageNotModifiedError:
+                return message
+
+        result = await self._submit(message.chat_id, call, True)
+        self.edits += 1
+        return result
+
+    async def start(self):
+        """Start dispatcher task"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        """Stop dispatcher, letting calls in progress finish and failing calls still queued"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.gather(*self._calls, return_exceptions=True)
+
+        for queue in self._chats.values():
+            for job in queue:
+                if not job['future'].done():
+                    job['future'].cancel()
+        self._chats.clear()
+        self._ready.clear()
+        self.queued = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get send queue counters"""
+        return {
+            'queued': self.queued,
+            'chats': len(self._chats),
+            'in_flight': len(self._busy),
+            'sent': self.sent,
+            'edits': self.edits,
+            'split_messages': self.split_messages,
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': self.flood_wait_seconds,
+            'retries': self.retries,
+            'failures': self.failures,
+            'queue_wait': self.queue_wait.get_stats(),
+        }
+
+    def _submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], idempotent: bool) -> asyncio.Future:
+        """Queue call for chat and return future of its result"""
+        future = asyncio.get_running_loop().create_future()
+        job = {
+            'call': call,
+            'future': future,
+            'idempotent': idempotent,
+            'attempt': 0,
+            'started': False,
+            'enqueued': time.monotonic(),
+        }
+
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            if chat_id not in self._busy:
+                self._ready.append(chat_id)
+        queue.append(job)
+        self.queued += 1
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return future
+
+    async def _dispatch(self):
+        """Start calls for chats whose per-chat and global limits allow it"""
+        while True:
+            now = time.monotonic()
+            delay = None
+
+            # Forget pacing of chats that are quiet long enough
+            if len(self._next_at) > 1000:
+                self._next_at = {chat_id: at for chat_id, at in self._next_at.items() if at > now}
+
+            for chat_id in list(self._ready):
+                wait = self._next_at.get(chat_id, 0.0) - now
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                    continue
+
+                global_wait = self.bucket.time_until(1)
+                if global_wait > 0:
+                    delay = global_wait if delay is None else min(delay, global_wait)
+                    break
+
+                self.bucket.consume(1)
+                self._ready.remove(chat_id)
+                self._busy.add(chat_id)
+                task = asyncio.create_task(self._run(chat_id))
+                self._calls.add(task)
+                task.add_done_callback(self._calls.discard)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, chat_id: int):
+        """Run first queued call of chat"""
+        queue = self._chats[chat_id]
+        job = queue[0]
+        pause = self.chat_interval
+
+        try:
+            if not job['started']:
+                job['started'] = True
+                self.queue_wait.record(time.monotonic() - job['enqueued'])
+            result = await job['call']()
+            self._finish(queue, job, result=result)
+
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            self.flood_wait_seconds += e.seconds
+            if e.seconds > self.max_flood_wait:
+                self._finish(queue, job, error=e)
+            else:
+                # Nothing was sent, safe to repeat after the wait
+                print(f"Flood wait {e.seconds}s for chat {chat_id}")
+                pause = max(pause, e.seconds)
+
+        except Exception as e:
+            if job['idempotent'] and job['attempt'] < self.max_retries:
+                job['attempt'] += 1
+                self.retries += 1
+                pause = max(pause, backoff_delay(job['attempt'] - 1))
+            else:
+                self._finish(queue, job, error=e)
+
+        finally:
+            self._busy.discard(chat_id)
+            self._next_at[chat_id] = time.monotonic() + pause
+            if queue:
+                self._ready.append(chat_id)
+            else:
+                self._chats.pop(chat_id, None)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _finish(self, queue: Deque[Dict[str, Any]], job: Dict[str, Any], result: Any = None, error: Optional[Exception] = None):
+        """Remove call from queue and resolve its future"""
+        queue.popleft()
+        self.queued -= 1
+        if job['future'].done():
+            return
+        if error is not None:
+            self.failures += 1
+            job['future'].set_exception(error)
+        else:
+            job['future'].set_result(result)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background write-behind persistence service
+"""
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def atomic_write_json(path: Path, data: Any, indent: Optional[int] = None):
+    """Write JSON to temp file and atomically rename over target (compact unless indented)"""
+    tmp_file = path.with_name(path.name + '.tmp')
+    separators = None if indent is not None else (',', ':')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent, separators=separators)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+class PersistenceService:
+    """Coalesce disk writes and run them off the event loop
+
+    Components call ``mark_dirty(key, writer, snapshot)`` instead of writing
+    files themselves. Repeated calls for the same key are coalesced: on the
+    next flush ``snapshot()`` is taken on the event loop and ``writer(data)``
+    runs in a worker thread. Flushes happen every ``flush_interval`` seconds
+    or as soon as ``max_dirty`` changes are pending.
+
+    Until ``start()`` is called writes are performed synchronously.
+    Callbacks registered with ``add_periodic()`` (cache sweeps and other
+    housekeeping) run on the same loop between flushes.
+    """
+
+    def __init__(self, flush_interval: float = 2.0, max_dirty: int = 100):
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+
+        # key -> (writer, snapshot)
+        self._dirty: Dict[str, Tuple[Callable, Optional[Callable[[], Any]]]] = {}
+        self._dirty_count = 0
+
+        # Housekeeping callbacks: [callback, interval, last run]
+        self._periodic: List[list] = []
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+
+        # Counters
+        self.flushes = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_flush_duration = 0.0
+
+    @property
+    def running(self) -> bool:
+        """Check if background flusher is running"""
+        return self._task is not None and not self._task.done()
+
+    def mark_dirty(
+        self,
+        key: str,
+        writer: Callable,
+        snapshot: Optional[Callable[[], Any]] = None
+    ):
+        """Schedule ``writer`` for key (called with ``snapshot()`` result if given)"""
+        if not self.running:
+            self._write(key, writer, snapshot() if snapshot else None, snapshot is not None)
+            return
+
+        if key in self._dirty:
+            self.coalesced += 1
+        self._dirty[key] = (writer, snapshot)
+        self._dirty_count += 1
+
+        if self._dirty_count >= self.max_dirty:
+            self._wakeup.set()
+
+    def add_periodic(self, callback: Callable[[], Any], interval: float):
+        """Run ``callback`` on the flusher loop about every ``interval`` seconds"""
+        self._periodic.append([callback, interval, time.monotonic()])
+
+    async def start(self):
+        """Start background flusher"""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop background flusher and drain pending writes"""
+        if self._task:
+            # Let a flush in progress finish; cancelling would leave its
+            # worker thread writing while the final flush starts
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        if self._flush_lock:
+            await self.flush()
+        else:
+            self.flush_sync()
+
+    async def flush(self):
+        """Write all dirty entries in a worker thread"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            dirty, self._dirty = self._dirty, {}
+            self._dirty_count = 0
+
+            # Snapshots are taken on the loop so writers see consistent data
+            jobs = [
+                (key, writer, snapshot() if snapshot else None, snapshot is not None)
+                for key, (writer, snapshot) in dirty.items()
+            ]
+
+            start = time.monotonic()
+            await asyncio.to_thread(self._write_all, jobs)
+            self.last_flush_duration = time.monotonic() - start
+            self.flushes += 1
+
+    def flush_sync(self):
+        """Write all dirty entries in the current thread"""
+        dirty, self._dirty = self._dirty, {}
+        self._dirty_count = 0
+        self._write_all([
+            (key, writer, snapshot() if snapshot else None, snapshot is not None)
+            for key, (writer, snapshot) in dirty.items()
+        ])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get persistence counters"""
+        return {
+            'pending': len(self._dirty),
+            'flushes': self.flushes,
+            'writes': self.writes,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'last_flush_duration': self.last_flush_duration,
+        }
+
+    async def _run(self):
+        """Flush on interval or when too many changes are pending"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+
+            try:
+                await self.flush()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error flushing pending writes: {e}")
+
+            self._run_periodic()
+
+    def _run_periodic(self):
+        """Run housekeeping callbacks that are due"""
+        now = time.monotonic()
+        for entry in self._periodic:
+            callback, interval, last_run = entry
+            if now - last_run < interval:
+                continue
+            entry[2] = now
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in periodic task: {e}")
+
+    def _write_all(self, jobs: list):
+        """Run writers one after another"""
+        for key, writer, data, has_snapshot in jobs:
+            self._write(key, writer, data, has_snapshot)
+
+    def _write(self, key: str, writer: Callable, data: Any, has_snapshot: bool):
+        """Run single writer, never raising"""
+        try:
+            if has_snapshot:
+                writer(data)
+            else:
+                writer()
+            self.writes += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing {key}: {e}")
+
+
+# Global persistence service instance
+_persistence: Optional[PersistenceService] = None
+
+
+def get_persistence() -> PersistenceService:
+    """Get or create global persistence service"""
+    global _persistence
+    if _persistence is None:
+        _persistence = PersistenceService()
+    return _persistence
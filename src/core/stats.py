@@ -4,20 +4,64 @@
 Statistics and analytics system
 """
 
+import asyncio
+import heapq
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from collections import defaultdict
 
+from src.core.persistence import atomic_write_json, get_persistence
+from src.core.timeseries import TimeSeriesStore, bucket_key
+
+
+# Metrics summed for the last 7 days in !stats
+WEEK_METRICS = ('messages_received', 'messages_sent')
 
-class Statistics:
-    """Bot statistics tracker"""
 
-    def __init__(self, data_dir: Path):
+def _empty_cost() -> Dict[str, Any]:
+    """Zeroed token and latency totals"""
+    return {
+        'requests': 0,
+        'cached': 0,
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'queue_time': 0.0,
+        'llm_time': 0.0,
+        'send_time': 0.0,
+    }
+
+
+class Statistics:
+    """Bot statistics tracker
+
+    Counters live in memory. A snapshot is handed to the persistence
+    service every ``flush_interval`` seconds (once ``start()`` was called)
+    or after ``flush_every`` changes, and on ``stop()``. Per-hour, day and
+    month message and cost counters live in a ``TimeSeriesStore``.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        flush_interval: float = 30.0,
+        flush_every: int = 500,
+        timeseries: Optional[TimeSeriesStore] = None,
+        top_k: int = 10
+    ):
         self.data_dir = data_dir
         self.stats_file = data_dir / 'statistics.json'
 
+        # Time-bucketed counters
+        self.timeseries = timeseries or TimeSeriesStore(data_dir / 'statistics.db')
+
+        # Snapshot flushing
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self._dirty = 0
+        self._flush_task: Optional[asyncio.Task] = None
+
         # Statistics data
         self.total_messages_received = 0
         self.total_messages_sent = 0
@@ -28,20 +72,37 @@ class Statistics:
             'last_contact': None,
             'name': 'Unknown'
         })
-        self.daily_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {
-            'messages_received': 0,
-            'messages_sent': 0
-        })
         self.personality_usage: Dict[str, int] = defaultdict(int)
         self.command_usage: Dict[str, int] = defaultdict(int)
 
+        # AI request cost (tokens and seconds) per user and personality
+        self.cost_total: Dict[str, Any] = _empty_cost()
+        self.user_cost: Dict[int, Dict[str, Any]] = defaultdict(_empty_cost)
+        self.personality_cost: Dict[str, Dict[str, Any]] = defaultdict(_empty_cost)
+
+        # Answers skipped or postponed under overload
+        self.shed_counts: Dict[str, int] = defaultdict(int)
+        self.deferred_count = 0
+
+        # Leaders kept up to date on every write (counters only grow)
+        self.top_k = top_k
+        self._top_users: List[int] = []
+        self._top_personality: Optional[str] = None
+
+        # Rendered !stats text, dropped when shown numbers change
+        self._formatted_stats: Optional[str] = None
+        self._formatted_stats_day: Optional[str] = None
+
+        # Last 7 days of WEEK_METRICS, day -> metric -> count; read from
+        # the time series once, then kept up to date in memory
+        self._week: Optional[Dict[str, Dict[str, float]]] = None
+
         # Load existing stats
         self._load_stats()
 
     def record_message_received(self, user_id: int, user_name: str = "Unknown"):
         """Record incoming message"""
         self.total_messages_received += 1
-        today = datetime.now().strftime('%Y-%m-%d')
 
         # Update user stats
         if self.user_stats[user_id]['first_contact'] is None:
@@ -50,47 +111,146 @@ class Statistics:
         self.user_stats[user_id]['messages_received'] += 1
         self.user_stats[user_id]['last_contact'] = datetime.now().isoformat()
         self.user_stats[user_id]['name'] = user_name
+        self._update_top_users(user_id)
 
-        # Update daily stats
-        self.daily_stats[today]['messages_received'] += 1
+        # Update time series
+        self.timeseries.increment('messages_received', user_id=user_id)
+        self._count_week('messages_received')
 
         self._save_stats()
 
     def record_message_sent(self, user_id: int):
         """Record outgoing message"""
         self.total_messages_sent += 1
-        today = datetime.now().strftime('%Y-%m-%d')
 
         # Update user stats
         self.user_stats[user_id]['messages_sent'] += 1
 
-        # Update daily stats
-        self.daily_stats[today]['messages_sent'] += 1
+        # Update time series
+        self.timeseries.increment('messages_sent', user_id=user_id)
+        self._count_week('messages_sent')
 
         self._save_stats()
 
     def record_personality_used(self, personality: str):
         """Record personality usage"""
         self.personality_usage[personality] += 1
+        top = self._top_personality
+        if top is None or self.personality_usage[personality] > self.personality_usage[top]:
+            self._top_personality = personality
         self._save_stats()
 
     def record_command_used(self, command: str):
         """Record command usage"""
         self.command_usage[command] += 1
+        self._save_stats(changes_summary=False)
+
+    def record_request_cost(self, user_id: int, personality: str, usage):
+        """Record tokens and timings of one AI request"""
+        values = {
+            'requests': 1,
+            'cached': int(usage.cached),
+            'input_tokens': usage.input_tokens,
+            'output_tokens': usage.output_tokens,
+            'queue_time': usage.queue_time,
+            'llm_time': usage.llm_time,
+            'send_time': usage.send_time,
+        }
+
+        for cost in (self.cost_total, self.user_cost[user_id], self.personality_cost[personality]):
+            for key, value in values.items():
+                cost[key] += value
+
+        for key, value in values.items():
+            self.timeseries.increment(key, value)
+
+        self._save_stats(changes_summary=False)
+
+    def record_shed(self, reason: str):
+        """Record answer replaced or dropped under overload"""
+        self.shed_counts[reason] += 1
+        self._save_stats()
+
+    def record_deferred(self):
+        """Record answer postponed under overload"""
+        self.deferred_count += 1
         self._save_stats()
 
+    def get_formatted_cost(self, user_id: Optional[int] = None) -> str:
+        """Get formatted token and latency usage string"""
+        def describe(cost: Dict[str, Any]) -> str:
+            requests = cost['requests'] or 1
+            return (
+                f"{cost['requests']} запросов ({cost['cached']} из кэша), "
+                f"токены {cost['input_tokens']} вход / {cost['output_tokens']} выход, "
+                f"в среднем очередь {cost['queue_time'] / requests:.2f}с, "
+                f"модель {cost['llm_time'] / requests:.2f}с, "
+                f"отправка {cost['send_time'] / requests:.2f}с"
+            )
+
+        today = _empty_cost()
+        for key, value in self.timeseries.summary('day').items():
+            if key in today:
+                today[key] = type(today[key])(value)
+
+        cost_text = "💸 Расход AI:\n\n"
+        cost_text += f"Всего: {describe(self.cost_total)}\n\n"
+        cost_text += f"Сегодня: {describe(today)}\n\n"
+        if user_id is not None:
+            cost_text += f"Твои запросы: {describe(self.user_cost.get(user_id) or _empty_cost())}\n\n"
+
+        if self.personality_cost:
+            cost_text += "🎭 По личностям:\n"
+            for personality, cost in sorted(self.personality_cost.items(), key=lambda x: -x[1]['output_tokens']):
+                cost_text += f"• {personality}: {describe(cost)}\n"
+
+        return cost_text
+
+    def get_series(
+        self,
+        metric: str,
+        resolution: str = 'hour',
+        days: int = 7,
+        user_id: Optional[int] = None
+    ) -> list:
+        """Get (bucket, value) pairs of metric for the last ``days`` days"""
+        now = datetime.now()
+        return self.timeseries.query(metric, resolution, now - timedelta(days=days), now, user_id)
+
     def get_user_stats(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get statistics for specific user"""
         return self.user_stats.get(user_id)
 
     def get_top_users(self, limit: int = 10) -> list:
         """Get top users by message count"""
-        sorted_users = sorted(
-            self.user_stats.items(),
-            key=lambda x: x[1]['messages_received'],
-            reverse=True
+        if limit <= self.top_k:
+            return [(user_id, self.user_stats[user_id]) for user_id in self._top_users[:limit]]
+
+        return heapq.nlargest(limit, self.user_stats.items(), key=lambda x: x[1]['messages_received'])
+
+    def _update_top_users(self, user_id: int):
+        """Keep top-K list sorted after user's count grew"""
+        top = self._top_users
+        count = self.user_stats[user_id]['messages_received']
+
+        if user_id not in top:
+            if len(top) >= self.top_k and count <= self.user_stats[top[-1]]['messages_received']:
+                return
+            top.append(user_id)
+
+        top.sort(key=lambda uid: self.user_stats[uid]['messages_received'], reverse=True)
+        del top[self.top_k:]
+
+    def _rebuild_leaders(self):
+        """Compute top users and personality from scratch (after load)"""
+        self._top_users = [
+            user_id for user_id, _ in heapq.nlargest(
+                self.top_k, self.user_stats.items(), key=lambda x: x[1]['messages_received']
+            )
+        ]
+        self._top_personality = (
+            max(self.personality_usage.items(), key=lambda x: x[1])[0] if self.personality_usage else None
         )
-        return sorted_users[:limit]
 
     def get_summary(self) -> Dict[str, Any]:
         """Get statistics summary"""
@@ -98,19 +258,33 @@ class Statistics:
             'total_messages_received': self.total_messages_received,
             'total_messages_sent': self.total_messages_sent,
             'total_users': len(self.user_stats),
-            'top_personality': max(self.personality_usage.items(), key=lambda x: x[1])[0] if self.personality_usage else 'default',
+            'top_personality': self._top_personality or 'default',
             'top_users': self.get_top_users(5),
+            'shed': sum(self.shed_counts.values()),
+            'deferred': self.deferred_count,
+            'week': self._week_totals(),
         }
 
     def get_formatted_stats(self) -> str:
-        """Get formatted statistics string"""
+        """Get formatted statistics string (cached until shown numbers change)"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self._formatted_stats is not None and self._formatted_stats_day == today:
+            return self._formatted_stats
+
         summary = self.get_summary()
 
         stats_text = "📊 Статистика бота:\n\n"
         stats_text += f"📨 Всего сообщений получено: {summary['total_messages_received']}\n"
         stats_text += f"📤 Всего сообщений отправлено: {summary['total_messages_sent']}\n"
         stats_text += f"👥 Всего пользователей: {summary['total_users']}\n"
-        stats_text += f"🎭 Популярная личность: {summary['top_personality']}\n\n"
+        stats_text += (
+            f"📅 За 7 дней: получено {int(summary['week'].get('messages_received', 0))}, "
+            f"отправлено {int(summary['week'].get('messages_sent', 0))}\n"
+        )
+        stats_text += f"🎭 Популярная личность: {summary['top_personality']}\n"
+        if summary['shed'] or summary['deferred']:
+            stats_text += f"🚦 При перегрузке: пропущено {summary['shed']}, отложено {summary['deferred']}\n"
+        stats_text += "\n"
 
         if summary['top_users']:
             stats_text += "🏆 Топ пользователей:\n"
@@ -119,24 +293,101 @@ class Statistics:
                 msg_count = data.get('messages_received', 0)
                 stats_text += f"{i}. {name}: {msg_count} сообщений\n"
 
+        self._formatted_stats = stats_text
+        self._formatted_stats_day = today
         return stats_text
 
-    def _save_stats(self):
+    def _count_week(self, metric: str):
+        """Add one to today's count of metric in the 7-day totals"""
+        if self._week is None:
+            return
+        day = self._week.setdefault(bucket_key(datetime.now(), 'day'), {})
+        day[metric] = day.get(metric, 0) + 1
+
+    def _week_totals(self) -> Dict[str, float]:
+        """Sum of WEEK_METRICS over the last 7 days"""
+        now = datetime.now()
+        first_day = bucket_key(now - timedelta(days=6), 'day')
+
+        if self._week is None:
+            self._week = {}
+            for metric in WEEK_METRICS:
+                for day, value in self.timeseries.query(metric, 'day', now - timedelta(days=6), now):
+                    self._week.setdefault(day, {})[metric] = value
+
+        for day in [day for day in self._week if day < first_day]:
+            del self._week[day]
+
+        totals: Dict[str, float] = {}
+        for counts in self._week.values():
+            for metric, value in counts.items():
+                totals[metric] = totals.get(metric, 0) + value
+        return totals
+
+    async def start(self):
+        """Start periodic snapshot flushing"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stop periodic flushing and hand over final snapshot"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self.flush()
+
+    def flush(self):
+        """Schedule snapshot write if anything changed"""
+        if not self._dirty:
+            return
+        self._dirty = 0
+        persistence = get_persistence()
+        persistence.mark_dirty('statistics', self._write_stats, self._snapshot_stats)
+        persistence.mark_dirty('statistics_timeseries', self.timeseries.flush)
+
+    async def _run_flusher(self):
+        """Flush on interval"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def _save_stats(self, changes_summary: bool = True):
+        """Count change, flushing once enough changes piled up"""
+        if changes_summary:
+            self._formatted_stats = None
+
+        self._dirty += 1
+        if self._dirty >= self.flush_every:
+            self.flush()
+
+    def _snapshot_stats(self) -> Dict[str, Any]:
+        """Copy statistics for writing outside the event loop"""
+        return {
+            'total_messages_received': self.total_messages_received,
+            'total_messages_sent': self.total_messages_sent,
+            'user_stats': {user_id: dict(stats) for user_id, stats in self.user_stats.items()},
+            'personality_usage': dict(self.personality_usage),
+            'command_usage': dict(self.command_usage),
+            'cost_stats': {
+                'total': dict(self.cost_total),
+                'users': {user_id: dict(cost) for user_id, cost in self.user_cost.items()},
+                'personalities': {name: dict(cost) for name, cost in self.personality_cost.items()},
+            },
+            'load_shedding': {
+                'shed': dict(self.shed_counts),
+                'deferred': self.deferred_count,
+            },
+            'last_updated': datetime.now().isoformat()
+        }
+
+    def _write_stats(self, stats_data: Dict[str, Any]):
         """Save statistics to file"""
         try:
-            stats_data = {
-                'total_messages_received': self.total_messages_received,
-                'total_messages_sent': self.total_messages_sent,
-                'user_stats': dict(self.user_stats),
-                'daily_stats': dict(self.daily_stats),
-                'personality_usage': dict(self.personality_usage),
-                'command_usage': dict(self.command_usage),
-                'last_updated': datetime.now().isoformat()
-            }
-
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(stats_data, f, ensure_ascii=False, indent=2)
-
+            atomic_write_json(self.stats_file, stats_data)
         except Exception as e:
             print(f"Error saving statistics: {e}")
 
@@ -156,10 +407,6 @@ class Statistics:
                     user_id = int(user_id_str)
                     self.user_stats[user_id] = stats
 
-                # Load daily stats
-                daily_stats_data = data.get('daily_stats', {})
-                for date, stats in daily_stats_data.items():
-                    self.daily_stats[date] = stats
 
                 # Load personality usage
                 self.personality_usage = defaultdict(int, data.get('personality_usage', {}))
@@ -167,15 +414,59 @@ class Statistics:
                 # Load command usage
                 self.command_usage = defaultdict(int, data.get('command_usage', {}))
 
+                # Load AI request cost
+                cost_data = data.get('cost_stats', {})
+                self.cost_total.update(cost_data.get('total', {}))
+                for user_id_str, cost in cost_data.get('users', {}).items():
+                    self.user_cost[int(user_id_str)].update(cost)
+                for name, cost in cost_data.get('personalities', {}).items():
+                    self.personality_cost[name].update(cost)
+
+                # Load overload counters
+                shedding_data = data.get('load_shedding', {})
+                self.shed_counts = defaultdict(int, shedding_data.get('shed', {}))
+                self.deferred_count = shedding_data.get('deferred', 0)
+
+                # Move per-day counters of older versions into time series
+                if 'daily_stats' in data or 'daily' in cost_data:
+                    self._migrate_daily(data.get('daily_stats', {}), cost_data.get('daily', {}))
+
         except Exception as e:
             print(f"Error loading statistics: {e}")
 
+        self._rebuild_leaders()
+
+    def _migrate_daily(self, daily_stats: Dict[str, Dict[str, Any]], daily_cost: Dict[str, Dict[str, Any]]):
+        """Import per-day JSON counters into time series and rewrite file without them"""
+        for daily in (daily_stats, daily_cost):
+            for date, values in daily.items():
+                when = datetime.strptime(date, '%Y-%m-%d')
+                for key, value in values.items():
+                    self.timeseries.increment(key, value, when=when)
+
+        # Write both right away so a restart can't import twice
+        self.timeseries.flush()
+        self._write_stats(self._snapshot_stats())
+        print(f"Moved {len(daily_stats)} days of statistics to {self.timeseries.db_file.name}")
+
+    def close(self):
+        """Flush and close time series store"""
+        self.timeseries.close()
+
     def reset_stats(self):
         """Reset all statistics"""
         self.total_messages_received = 0
         self.total_messages_sent = 0
         self.user_stats.clear()
-        self.daily_stats.clear()
         self.personality_usage.clear()
         self.command_usage.clear()
+        self.cost_total = _empty_cost()
+        self.user_cost.clear()
+        self.personality_cost.clear()
+        self.shed_counts.clear()
+        self.deferred_count = 0
+        self.timeseries.clear()
+        self._week = None
+        self._rebuild_leaders()
         self._save_stats()
+        self.flush()
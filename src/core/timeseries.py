@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time-bucketed counters stored in SQLite
+"""
+
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import DefaultDict, Dict, List, Optional, Tuple
+
+
+# Bucket key formats; each is a prefix of the finer one
+BUCKET_FORMATS = {
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+}
+
+# user_id of rows summed over all users
+ALL_USERS = 0
+
+
+def bucket_key(when: datetime, resolution: str) -> str:
+    """Get bucket key of time for resolution"""
+    return when.strftime(BUCKET_FORMATS[resolution])
+
+
+class TimeSeriesStore:
+    """Counters per hour, day and month, overall and per user
+
+    ``increment()`` only touches in-memory maps of pending hourly deltas
+    (totals and per-user kept apart). ``flush()`` (safe to call from a
+    worker thread) adds them to the hour, day and month rows in one
+    transaction, stamps it with a generation number and drops hourly and
+    daily rows older than their retention. Monthly rows are kept forever.
+
+    Queries run on a separate read connection, so under WAL they never wait
+    for a flush. Deltas still in memory, or in a flush the read snapshot
+    does not include yet, are added on top.
+    """
+
+    def __init__(
+        self,
+        db_file: Path,
+        hourly_retention_days: int = 14,
+        daily_retention_days: int = 365,
+        prune_interval: float = 3600.0
+    ):
+        self.db_file = db_file
+        self.hourly_retention_days = hourly_retention_days
+        self.daily_retention_days = daily_retention_days
+        self.prune_interval = prune_interval
+
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS stats_buckets ('
+            'resolution TEXT NOT NULL, '
+            'bucket TEXT NOT NULL, '
+            'user_id INTEGER NOT NULL, '
+            'metric TEXT NOT NULL, '
+            'value REAL NOT NULL, '
+            'PRIMARY KEY (resolution, metric, user_id, bucket)) WITHOUT ROWID'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS stats_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+        )
+        self.conn.commit()
+        row = self.conn.execute("SELECT value FROM stats_meta WHERE key = 'generation'").fetchone()
+        self._generation = row[0] if row else 0
+
+        # Autocommit, transactions are opened explicitly for consistent reads
+        self.read_conn = sqlite3.connect(str(db_file), check_same_thread=False, isolation_level=None)
+
+        # (hour bucket, metric) -> delta not yet written, all users and per user
+        self._pending: DefaultDict[Tuple[str, str], float] = defaultdict(float)
+        self._pending_users: Dict[int, DefaultDict[Tuple[str, str], float]] = {}
+        # Deltas being written: (generation, totals, per user)
+        self._flushing: Optional[Tuple[int, Dict, Dict]] = None
+        self._pending_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def increment(self, metric: str, value: float = 1, user_id: Optional[int] = None, when: Optional[datetime] = None):
+        """Add value to metric in the hour of ``when`` (now by default)"""
+        key = (bucket_key(when or datetime.now(), 'hour'), metric)
+        with self._pending_lock:
+            self._pending[key] += value
+            if user_id is not None:
+                user_pending = self._pending_users.get(user_id)
+                if user_pending is None:
+                    user_pending = self._pending_users[user_id] = defaultdict(float)
+                user_pending[key] += value
+
+    def query(
+        self,
+        metric: str,
+        resolution: str = 'hour',
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        user_id: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """Get (bucket, value) pairs of metric between start and end, oldest first"""
+        end = end or datetime.now()
+        start = start or end - timedelta(days=7)
+        first, last = bucket_key(start, resolution), bucket_key(end, resolution)
+        user_id = ALL_USERS if user_id is None else user_id
+
+        rows, deltas = self._read(
+            'SELECT bucket, value FROM stats_buckets '
+            'WHERE resolution = ? AND metric = ? AND user_id = ? AND bucket BETWEEN ? AND ? '
+            'ORDER BY bucket',
+            (resolution, metric, user_id, first, last),
+            user_id
+        )
+
+        values: Dict[str, float] = dict(rows)
+        key_length = len(first)
+        for (hour, pending_metric), delta in deltas:
+            bucket = hour[:key_length]
+            if pending_metric == metric and first <= bucket <= last:
+                values[bucket] = values.get(bucket, 0.0) + delta
+
+        return sorted(values.items())
+
+    def summary(
+        self,
+        resolution: str = 'day',
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        user_id: Optional[int] = None
+    ) -> Dict[str, float]:
+        """Get every metric summed over buckets between start and end"""
+        end = end or datetime.now()
+        start = start or end
+        first, last = bucket_key(start, resolution), bucket_key(end, resolution)
+        user_id = ALL_USERS if user_id is None else user_id
+
+        rows, deltas = self._read(
+            'SELECT metric, SUM(value) FROM stats_buckets '
+            'WHERE resolution = ? AND user_id = ? AND bucket BETWEEN ? AND ? '
+            'GROUP BY metric',
+            (resolution, user_id, first, last),
+            user_id
+        )
+
+        totals: Dict[str, float] = dict(rows)
+        key_length = len(first)
+        for (hour, metric), delta in deltas:
+            if first <= hour[:key_length] <= last:
+                totals[metric] = totals.get(metric, 0.0) + delta
+
+        return totals
+
+    def flush(self):
+        """Write pending deltas to all resolutions (safe to call from any thread)"""
+        with self._io_lock:
+            with self._pending_lock:
+                generation = self._generation + 1
+                totals, users = self._pending, self._pending_users
+                self._pending, self._pending_users = defaultdict(float), {}
+                self._flushing = (generation, totals, users)
+
+            try:
+                rows = []
+                pending = [(ALL_USERS, totals)] + list(users.items())
+                for user_id, deltas in pending:
+                    for (hour, metric), delta in deltas.items():
+                        rows.append(('hour', hour, user_id, metric, delta))
+                        rows.append(('day', hour[:10], user_id, metric, delta))
+                        rows.append(('month', hour[:7], user_id, metric, delta))
+                if rows:
+                    self.conn.executemany(
+                        'INSERT INTO stats_buckets (resolution, bucket, user_id, metric, value) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (resolution, metric, user_id, bucket) DO UPDATE SET value = value + excluded.value',
+                        rows
+                    )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO stats_meta (key, value) VALUES ('generation', ?)", (generation,)
+                )
+
+                if time.monotonic() - self._last_prune >= self.prune_interval:
+                    self._prune()
+
+                self.conn.commit()
+                self._generation = generation
+            except Exception:
+                # Keep deltas for the next flush
+                self.conn.rollback()
+                with self._pending_lock:
+                    self._merge_pending(totals, users)
+                raise
+            finally:
+                with self._pending_lock:
+                    self._flushing = None
+
+    def clear(self):
+        """Delete all buckets"""
+        with self._io_lock:
+            with self._pending_lock:
+                self._pending.clear()
+                self._pending_users.clear()
+            self.conn.execute('DELETE FROM stats_buckets')
+            self.conn.commit()
+
+    def close(self):
+        """Flush and close database"""
+        self.flush()
+        self.read_conn.close()
+        self.conn.close()
+
+    def _read(self, sql: str, params: Tuple, user_id: int) -> Tuple[List[Tuple], List[Tuple[Tuple[str, str], float]]]:
+        """Run query on read connection and get deltas of user it does not include yet"""
+        # Holding the pending lock keeps a flush from swapping or dropping
+        # its batch meanwhile; it does not wait for the write transaction
+        with self._pending_lock:
+            self.read_conn.execute('BEGIN')
+            try:
+                row = self.read_conn.execute("SELECT value FROM stats_meta WHERE key = 'generation'").fetchone()
+                rows = self.read_conn.execute(sql, params).fetchall()
+            finally:
+                self.read_conn.execute('COMMIT')
+
+            deltas = list(self._user_pending(self._pending, self._pending_users, user_id).items())
+            if self._flushing is not None:
+                generation, totals, users = self._flushing
+                # Batch is not in the snapshot unless its commit is
+                if generation > (row[0] if row else 0):
+                    deltas += list(self._user_pending(totals, users, user_id).items())
+
+        return rows, deltas
+
+    def _merge_pending(self, totals: Dict, users: Dict):
+        """Add unwritten deltas back to pending (pending lock held)"""
+        for key, delta in totals.items():
+            self._pending[key] += delta
+        for user_id, deltas in users.items():
+            user_pending = self._pending_users.setdefault(user_id, defaultdict(float))
+            for key, delta in deltas.items():
+                user_pending[key] += delta
+
+    @staticmethod
+    def _user_pending(totals: Dict, users: Dict, user_id: int) -> Dict:
+        """Pending deltas of user (or of everyone for ALL_USERS)"""
+        if user_id == ALL_USERS:
+            return totals
+        return users.get(user_id) or {}
+
+    def _prune(self):
+        """Drop hourly and daily rows past retention"""
+        now = datetime.now()
+        self.conn.execute(
+            "DELETE FROM stats_buckets WHERE resolution = 'hour' AND bucket < ?",
+            (bucket_key(now - timedelta(days=self.hourly_retention_days), 'hour'),)
+        )
+        self.conn.execute(
+            "DELETE FROM stats_buckets WHERE resolution = 'day' AND bucket < ?",
+            (bucket_key(now - timedelta(days=self.daily_retention_days), 'day'),)
+        )
+        self._last_prune = time.monotonic()
@@ -11,22 +11,25 @@ from telethon import events
 class CommandHandler:
     """Handle bot commands"""
 
-    def __init__(self, config, ai_client, stats, logger):
+    def __init__(self, config, ai_client, stats, logger, perf):
         self.config = config
         self.ai_client = ai_client
         self.stats = stats
         self.logger = logger
+        self.perf = perf
 
         # Command registry
         self.commands: Dict[str, Callable] = {
             'help': self.cmd_help,
             'stats': self.cmd_stats,
+            'cost': self.cmd_cost,
             'clear': self.cmd_clear,
             'ignore': self.cmd_ignore,
             'unignore': self.cmd_unignore,
             'personality': self.cmd_personality,
             'personalities': self.cmd_list_personalities,
             'version': self.cmd_version,
+            'perf': self.cmd_perf,
         }
 
     async def handle_command(self, event, user_id: int, command: str, args: str) -> Optional[str]:
@@ -48,6 +51,7 @@ class CommandHandler:
 
 !help - показать это сообщение
 !stats - показать статистику бота
+!cost - показать расход токенов и задержки
 !clear - очистить историю диалога
 !personality [имя] - сменить стиль общения
 !personalities - показать доступные стили
@@ -65,6 +69,10 @@ class CommandHandler:
         """Show statistics"""
         return self.stats.get_formatted_stats()
 
+    async def cmd_cost(self, event, user_id: int, args: str) -> str:
+        """Show token usage and latency"""
+        return self.stats.get_formatted_cost(user_id)
+
     async def cmd_clear(self, event, user_id: int, args: str) -> str:
         """Clear conversation history"""
         self.ai_client.clear_user_history(user_id)
@@ -125,6 +133,27 @@ class CommandHandler:
 
         return text
 
+    async def cmd_perf(self, event, user_id: int, args: str) -> str:
+        """Show pipeline stage latencies (owner only)"""
+        if user_id not in self.config.OWNER_IDS:
+            return "эта команда только для владельца"
+
+        perf = self.perf.get_stats()
+        text = "⏱ Задержки по этапам (p50 / p95 / p99, мс):\n\n"
+        for stage, stats in perf['stages'].items():
+            if not stats['count']:
+                continue
+            text += (
+                f"• {stage}: {stats['p50'] * 1000:.0f} / {stats['p95'] * 1000:.0f} / "
+                f"{stats['p99'] * 1000:.0f} ({stats['count']})\n"
+            )
+
+        text += (
+            f"\n📈 За минуту: получено {perf['received_per_second'] * 60:.0f}, "
+            f"отвечено {perf['replied_per_second'] * 60:.0f}"
+        )
+        return text
+
     def is_command(self, text: str) -> bool:
         """Check if message is a command"""
         return text.startswith('!')
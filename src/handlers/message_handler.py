@@ -6,43 +6,96 @@ Message handler for processing incoming messages
 
 import asyncio
 import random
+import re
+import time
+from functools import partial
 from telethon import events
-from typing import List
+from typing import Any, Dict, List, Optional
+
+from src.ai.backend import RequestUsage
+from src.utils.cache import LRUCache
+
+# End of sentence followed by whitespace
+SENTENCE_END = re.compile(r'(?<=[.!?…\n])\s+')
+
+# Cheap replies when the AI pipeline is overloaded
+BUSY_REPLIES = [
+    "ой я щас немного занята, напишу чуть позже",
+    "сек, чуть позже отвечу",
+    "щас не могу, попозже напишу",
+]
 
 
 class MessageHandler:
     """Handle incoming messages"""
 
-    def __init__(self, config, ai_client, stats, command_handler, logger):
+    def __init__(self, config, ai_client, stats, command_handler, logger, dispatcher, outbound, perf):
         self.config = config
         self.ai_client = ai_client
         self.stats = stats
         self.command_handler = command_handler
         self.logger = logger
 
+        # Per-user ordered work queues
+        self.dispatcher = dispatcher
+
+        # Rate-limited Telegram sends
+        self.outbound = outbound
+
+        # Per-stage latency histograms
+        self.perf = perf
+
+        # Sender entities, so repeat senders cost no get_sender() calls
+        self.senders = LRUCache(capacity=config.SENDER_CACHE_SIZE, ttl=config.SENDER_CACHE_TTL)
+
         # Auto reactions
         self.reactions = ['👍', '❤️', '🔥', '😊', '😂', '🤔', '👌', '✨']
 
-    async def handle_message(self, event, client):
+        # Pending message bursts: user_id -> {'texts', 'event', 'received_at', 'timer'}
+        self._bursts: Dict[int, Dict[str, Any]] = {}
+
+        # Answers waiting out overload: user_id -> {'texts', 'event', 'client', 'received_at', 'deferrals', 'handle'}
+        self._deferred: Dict[int, Dict[str, Any]] = {}
+
+        # AI answers queued or running, with hysteresis overload flag
+        self.pending_answers = 0
+        self.overloaded = False
+
+        # Users the AI answered lately, they are the first to wait under overload
+        self._answered = LRUCache(capacity=config.SENDER_CACHE_SIZE, ttl=config.OVERLOAD_RECENT_SECONDS)
+
+    def dispatch(self, event, client):
+        """Queue incoming message behind earlier work of the same sender"""
+        # Local receipt time: message.date is server time with 1s resolution
+        received_at = time.monotonic()
+        self.dispatcher.submit(event.sender_id, partial(self.handle_message, event, client, received_at))
+
+    async def handle_message(self, event, client, received_at: Optional[float] = None):
         """Process incoming message"""
+        if received_at is None:
+            received_at = time.monotonic()
         try:
             # Ignore messages from self
             if event.out:
                 return
 
+            # Check if user is ignored (may have been ignored while message was queued)
+            user_id = event.sender_id
+            if self.config.is_user_ignored(user_id):
+                self.logger.info(f"Ignored message from ID: {user_id}")
+                return
+
+            self.perf.received.record()
+
             # Get sender info
-            user = await event.get_sender()
+            with self.perf.measure('sender'):
+                user = await self._get_sender(event)
             user_name = user.first_name if user.first_name else "Пользователь"
-            user_id = user.id
             message_text = event.message.text
 
-            # Check if user is ignored
-            if self.config.is_user_ignored(user_id):
-                self.logger.info(f"Ignored message from {user_name} (ID: {user_id})")
-                return
-
             # Record incoming message
-            self.stats.record_message_received(user_id, user_name)
+            with self.perf.measure('stats'):
+                self.stats.record_message_received(user_id, user_name)
             self.logger.message(f"Сообщение от {user_name} (ID: {user_id}): {message_text}")
 
             # Check for commands
@@ -51,7 +104,7 @@ class MessageHandler:
                 response = await self.command_handler.handle_command(event, user_id, command, args)
 
                 if response:
-                    await event.reply(response)
+                    await self.outbound.reply(event, response)
                     self.stats.record_message_sent(user_id)
                     self.logger.success(f"Команда обработана: !{command}")
                 return
@@ -66,6 +119,149 @@ class MessageHandler:
                 except:
                     pass  # Ignore if reactions not supported
 
+            # Wait for the rest of a burst before answering
+            self._buffer_message(event, client, user_id, message_text, received_at)
+
+        except Exception as e:
+            self.logger.error(f"Ошибка обработки сообщения: {str(e)}")
+            try:
+                await self.outbound.reply(event, "ой бл что то сломалось... напиши еще раз пжлст")
+            except:
+                pass
+
+    async def _get_sender(self, event):
+        """Get sender entity from cache or Telegram"""
+        user = self.senders.get(event.sender_id)
+        if user is None:
+            user = await event.get_sender()
+            self.senders.set(event.sender_id, user)
+        return user
+
+    def _buffer_message(self, event, client, user_id: int, message_text: str, received_at: float):
+        """Collect consecutive messages from user and answer once"""
+        burst = self._bursts.get(user_id)
+        if burst is None:
+            burst = self._bursts[user_id] = {'texts': [], 'event': event, 'received_at': received_at, 'timer': None}
+        else:
+            burst['timer'].cancel()
+
+        burst['texts'].append(message_text)
+        burst['event'] = event
+        burst['received_at'] = received_at
+        burst['timer'] = asyncio.create_task(self._answer_burst(user_id, client))
+
+    async def _answer_burst(self, user_id: int, client):
+        """Answer collected burst once debounce window has passed"""
+        await asyncio.sleep(self.config.MESSAGE_DEBOUNCE_SECONDS)
+
+        burst = self._bursts.pop(user_id)
+        texts = burst['texts']
+        deferrals = 0
+
+        # Deferred answer goes out together with the new messages
+        deferred = self._deferred.pop(user_id, None)
+        if deferred is not None:
+            deferred['handle'].cancel()
+            texts = deferred['texts'] + texts
+            deferrals = deferred['deferrals']
+
+        if len(texts) > 1:
+            self.logger.debug(f"Merged {len(texts)} messages from {user_id}")
+
+        self._queue_answer(burst['event'], client, user_id, texts, burst['received_at'], deferrals)
+
+    def _queue_answer(self, event, client, user_id: int, texts: List[str], received_at: float, deferrals: int = 0):
+        """Answer in the user's queue so history is not interleaved"""
+        self.pending_answers += 1
+        self.dispatcher.submit(user_id, partial(self._run_answer, event, client, user_id, texts, received_at, deferrals))
+
+    async def _run_answer(self, event, client, user_id: int, texts: List[str], received_at: float, deferrals: int):
+        """Answer queued burst unless overload handling takes care of it"""
+        try:
+            if self._check_overload() and await self._shed_answer(event, client, user_id, texts, received_at, deferrals):
+                return
+            await self._answer(event, client, user_id, '\n'.join(texts), received_at)
+        finally:
+            self.pending_answers -= 1
+            # Leave overload mode even if nothing else gets queued
+            self._check_overload()
+
+    def _check_overload(self) -> bool:
+        """Update overload flag from pending answers using high/low watermarks"""
+        if not self.overloaded and self.pending_answers >= self.config.OVERLOAD_HIGH_WATERMARK:
+            self.overloaded = True
+            self.logger.warning(f"Перегрузка: {self.pending_answers} ответов в очереди, включаю экономию")
+        elif self.overloaded and self.pending_answers <= self.config.OVERLOAD_LOW_WATERMARK:
+            self.overloaded = False
+            self.logger.info(f"Нагрузка спала ({self.pending_answers} ответов в очереди)")
+        return self.overloaded
+
+    async def _shed_answer(
+        self, event, client, user_id: int, texts: List[str], received_at: float, deferrals: int
+    ) -> bool:
+        """Degrade answer under overload, returns False if it should go to AI anyway"""
+        # Nobody waits for an answer to a message this old
+        age = time.monotonic() - received_at
+        if age > self.config.OVERLOAD_STALE_SECONDS:
+            self.stats.record_shed('stale')
+            self.logger.debug(f"Dropped stale message from {user_id} ({age:.0f}s old)")
+            return True
+
+        # Only users in a fresh exchange wait, first contacts and returning users get a real answer
+        if self._answered.get(user_id) is None:
+            return False
+
+        message_text = '\n'.join(texts)
+        personality_config = self.config.get_personality(self.ai_client.get_user_personality(user_id))
+        reply = self.ai_client.get_cached_response(user_id, message_text, personality_config)
+        if reply is not None:
+            self.stats.record_shed('cached')
+        elif deferrals < self.config.OVERLOAD_MAX_DEFERS:
+            self._defer_answer(event, client, user_id, texts, received_at, deferrals + 1)
+            self.stats.record_deferred()
+            return True
+        else:
+            reply = random.choice(BUSY_REPLIES)
+            self.stats.record_shed('canned')
+
+        await self.outbound.reply(event, reply)
+        self.stats.record_message_sent(user_id)
+        return True
+
+    def _defer_answer(self, event, client, user_id: int, texts: List[str], received_at: float, deferrals: int):
+        """Queue answer again after a pause"""
+        # Another answer of this user is already waiting, merge into one
+        previous = self._deferred.pop(user_id, None)
+        if previous is not None:
+            previous['handle'].cancel()
+            texts = previous['texts'] + texts
+            received_at = max(received_at, previous['received_at'])
+            deferrals = max(deferrals, previous['deferrals'])
+
+        # Jitter so deferred answers don't come back all at once
+        delay = self.config.OVERLOAD_DEFER_SECONDS * random.uniform(0.5, 1.5)
+        handle = asyncio.get_running_loop().call_later(delay, self._resume_deferred, user_id)
+        self._deferred[user_id] = {
+            'texts': texts,
+            'event': event,
+            'client': client,
+            'received_at': received_at,
+            'deferrals': deferrals,
+            'handle': handle,
+        }
+
+    def _resume_deferred(self, user_id: int):
+        """Put deferred answer back into the user's queue"""
+        deferred = self._deferred.pop(user_id, None)
+        if deferred is not None:
+            self._queue_answer(
+                deferred['event'], deferred['client'], user_id,
+                deferred['texts'], deferred['received_at'], deferred['deferrals']
+            )
+
+    async def _answer(self, event, client, user_id: int, message_text: str, received_at: float):
+        """Generate and send AI answer"""
+        try:
             # Show typing status
             async with client.action(event.chat_id, 'typing'):
                 # Get personality for user
@@ -75,24 +271,130 @@ class MessageHandler:
                 # Record personality usage
                 self.stats.record_personality_used(personality_name)
 
-                # Get AI response
-                response = await self.ai_client.get_response(
-                    user_id,
-                    message_text,
-                    personality_config
-                )
+                # Tokens and timings of this request
+                usage = RequestUsage()
 
-                # Natural typing delay
-                await asyncio.sleep(self.config.TYPING_DELAY)
+                if self.config.STREAMING_MODE == 'edit':
+                    response = await self._reply_streaming_edit(event, user_id, message_text, personality_config, usage)
+                elif self.config.STREAMING_MODE == 'sentences':
+                    response = await self._reply_streaming_sentences(event, user_id, message_text, personality_config, usage)
+                else:
+                    # Get AI response
+                    response = await self.ai_client.get_response(
+                        user_id,
+                        message_text,
+                        personality_config,
+                        usage=usage
+                    )
+
+                    # Natural typing delay, minus time already spent generating
+                    with self.perf.measure('typing'):
+                        await asyncio.sleep(self._remaining_typing_delay(received_at, response))
+
+                    # Send response
+                    send_started = time.monotonic()
+                    await self.outbound.reply(event, response)
+                    usage.send_time += time.monotonic() - send_started
 
-                # Send response
-                await event.reply(response)
                 self.stats.record_message_sent(user_id)
+                self.stats.record_request_cost(user_id, personality_name, usage)
+                self._answered.set(user_id, True)
+                self._observe_answer(usage, received_at)
                 self.logger.success(f"Ответ отправлен: {response[:50]}...")
 
         except Exception as e:
             self.logger.error(f"Ошибка обработки сообщения: {str(e)}")
             try:
-                await event.reply("ой бл что то сломалось... напиши еще раз пжлст")
+                await self.outbound.reply(event, "ой бл что то сломалось... напиши еще раз пжлст")
             except:
                 pass
+
+    def _observe_answer(self, usage: RequestUsage, received_at: float):
+        """Record stage latencies of answered message"""
+        if not usage.cached:
+            self.perf.observe('history', usage.history_time)
+            self.perf.observe('llm_queue', usage.queue_time)
+            self.perf.observe('llm_call', usage.llm_time)
+        self.perf.observe('send', usage.send_time)
+        # From receipt of the last message, not counting the debounce wait
+        total = time.monotonic() - received_at - self.config.MESSAGE_DEBOUNCE_SECONDS
+        self.perf.observe('total', max(0.0, total))
+        self.perf.replied.record()
+
+    def _remaining_typing_delay(self, received_at: float, response: str) -> float:
+        """Part of a human-like typing time for response still left since receipt"""
+        target = self.config.TYPING_DELAY
+        if self.config.TYPING_CHARS_PER_SECOND > 0:
+            target += len(response) / self.config.TYPING_CHARS_PER_SECOND
+        target = min(target, self.config.TYPING_MAX_DELAY)
+
+        return max(0.0, target - (time.monotonic() - received_at))
+
+    async def _reply_streaming_edit(
+        self, event, user_id: int, message_text: str, personality_config, usage: RequestUsage
+    ) -> str:
+        """Send first chunk early and keep editing the message while generating"""
+        text = ''
+        sent_text = ''
+        reply = None
+        last_edit = 0.0
+
+        async for chunk in self.ai_client.stream_response(user_id, message_text, personality_config, usage=usage):
+            text += chunk
+            if not text.strip():
+                continue
+
+            if reply is None:
+                send_started = time.monotonic()
+                reply = await self.outbound.reply(event, text)
+                sent_text = text
+                last_edit = time.monotonic()
+                usage.send_time += last_edit - send_started
+            elif time.monotonic() - last_edit >= self.config.STREAM_EDIT_INTERVAL:
+                send_started = time.monotonic()
+                await self.outbound.edit(reply, text)
+                sent_text = text
+                last_edit = time.monotonic()
+                usage.send_time += last_edit - send_started
+
+        send_started = time.monotonic()
+        if reply is None:
+            await self.outbound.reply(event, text or "...")
+        elif text != sent_text:
+            await self.outbound.edit(reply, text)
+        usage.send_time += time.monotonic() - send_started
+
+        return text
+
+    async def _reply_streaming_sentences(
+        self, event, user_id: int, message_text: str, personality_config, usage: RequestUsage
+    ) -> str:
+        """Send each finished sentence as separate message"""
+        text = ''
+        buffer = ''
+        first = True
+
+        async def send(part: str):
+            nonlocal first
+            send_started = time.monotonic()
+            if first:
+                await self.outbound.reply(event, part)
+                first = False
+            else:
+                await self.outbound.respond(event, part)
+            usage.send_time += time.monotonic() - send_started
+
+        async for chunk in self.ai_client.stream_response(user_id, message_text, personality_config, usage=usage):
+            text += chunk
+            buffer += chunk
+
+            # Flush all complete sentences, keep the unfinished tail
+            *sentences, buffer = SENTENCE_END.split(buffer)
+            for sentence in sentences:
+                if sentence.strip():
+                    await send(sentence.strip())
+
+        if buffer.strip() or first:
+            await send(buffer.strip() or "...")
+
+        return text
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded LRU cache with idle and age expiry
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Capacity- and byte-bounded LRU cache with idle-TTL eviction
+
+    Entries are evicted when the cache holds more than ``capacity`` items,
+    when the estimated size exceeds ``max_bytes``, when an entry has not
+    been accessed for ``idle_ttl`` seconds or was set more than ``ttl``
+    seconds ago. ``on_evict(key, value)`` is called for every evicted entry.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000,
+        max_bytes: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        size_of: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        ttl: Optional[float] = None
+    ):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.ttl = ttl
+        self.size_of = size_of or (lambda value: 0)
+        self.on_evict = on_evict
+
+        # key -> (value, size, last access time, set time)
+        self._data: 'OrderedDict[Hashable, list]' = OrderedDict()
+        self.total_bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value and mark it as recently used"""
+        entry = self._data.get(key)
+        now = time.monotonic()
+
+        if entry is None or self._is_expired(entry, now):
+            if entry is not None:
+                self._evict(key)
+            self.misses += 1
+            return default
+
+        entry[2] = now
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Insert or update value (also recomputes its size)"""
+        size = self.size_of(value)
+        entry = self._data.get(key)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+        now = time.monotonic()
+        self._data[key] = [value, size, now, now]
+        self._data.move_to_end(key)
+        self.total_bytes += size
+
+        self._enforce_limits()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove value without calling eviction callback"""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.total_bytes -= entry[1]
+        return entry[0]
+
+    def values(self) -> list:
+        """Get all cached values"""
+        return [entry[0] for entry in self._data.values()]
+
+    def evict_idle(self) -> int:
+        """Evict all entries idle or stored longer than TTL"""
+        if not self.idle_ttl and not self.ttl:
+            return 0
+
+        now = time.monotonic()
+        expired = [key for key, entry in self._data.items() if self._is_expired(entry, now)]
+        for key in expired:
+            self._evict(key)
+        return len(expired)
+
+    def clear(self):
+        """Evict all entries"""
+        for key in list(self._data):
+            self._evict(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _is_expired(self, entry: list, now: float) -> bool:
+        """Check if entry has been idle or stored longer than TTL"""
+        if self.idle_ttl and now - entry[2] > self.idle_ttl:
+            return True
+        return bool(self.ttl) and now - entry[3] > self.ttl
+
+    def _enforce_limits(self):
+        """Evict least recently used entries until limits are met"""
+        # Oldest entries sit at the front, so idle ones are found first
+        now = time.monotonic()
+        while self._data:
+            key, entry = next(iter(self._data.items()))
+            if not self._is_expired(entry, now):
+                break
+            self._evict(key)
+
+        # Always keep the most recent entry
+        while len(self._data) > 1 and (
+            len(self._data) > self.capacity
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            self._evict(next(iter(self._data)))
+
+    def _evict(self, key: Hashable):
+        """Remove entry and notify callback"""
+        value = self.pop(key)
+        self.evictions += 1
+        if self.on_evict:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"Error in cache eviction callback: {e}")
@@ -11,6 +11,8 @@ from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 from pathlib import Path
 
+from src.core.persistence import atomic_write_json, get_persistence
+
 # Load environment variables
 load_dotenv()
 
@@ -24,12 +26,29 @@ class Config:
         self.TELEGRAM_API_HASH = os.getenv('TELEGRAM_API_HASH')
         self.PHONE_NUMBER = os.getenv('PHONE_NUMBER')
 
+        # LLM backend: gemini or mock (offline load testing)
+        self.LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini').lower()
+        self.MOCK_LATENCY_MEAN = float(os.getenv('MOCK_LATENCY_MEAN', '0.8'))
+        self.MOCK_LATENCY_SIGMA = float(os.getenv('MOCK_LATENCY_SIGMA', '0.4'))
+        self.MOCK_TOKENS_PER_SECOND = float(os.getenv('MOCK_TOKENS_PER_SECOND', '50'))
+        self.MOCK_ERROR_RATE = float(os.getenv('MOCK_ERROR_RATE', '0.0'))
+        self.MOCK_SEED = int(os.getenv('MOCK_SEED')) if os.getenv('MOCK_SEED') else None
+
         # Gemini AI configuration
         self.GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+        self.GEMINI_MODELS = [
+            name.strip() for name in os.getenv('GEMINI_MODELS', 'gemini-1.5-flash').split(',') if name.strip()
+        ]
+        self.ROUTER_LATENCY_P95 = float(os.getenv('ROUTER_LATENCY_P95', '8.0'))
+        self.ROUTER_ERROR_RATE = float(os.getenv('ROUTER_ERROR_RATE', '0.5'))
+        self.ROUTER_COOLDOWN = float(os.getenv('ROUTER_COOLDOWN', '60'))
 
         # Bot configuration
         self.SESSION_NAME = os.getenv('SESSION_NAME', 'girlfriend_userbot')
         self.DEFAULT_PERSONALITY = os.getenv('DEFAULT_PERSONALITY', 'default')
+        self.OWNER_IDS = {
+            int(user_id) for user_id in os.getenv('OWNER_IDS', '').split(',') if user_id.strip()
+        }
 
         # Directories
         self.DATA_DIR = Path('data')
@@ -50,9 +69,66 @@ class Config:
         # AI configuration
         self.MAX_HISTORY_LENGTH = int(os.getenv('MAX_HISTORY_LENGTH', '20'))
         self.TYPING_DELAY = float(os.getenv('TYPING_DELAY', '0.5'))
+        self.TYPING_CHARS_PER_SECOND = float(os.getenv('TYPING_CHARS_PER_SECOND', '25'))
+        self.TYPING_MAX_DELAY = float(os.getenv('TYPING_MAX_DELAY', '4.0'))
+        self.MESSAGE_DEBOUNCE_SECONDS = float(os.getenv('MESSAGE_DEBOUNCE_SECONDS', '1.0'))
+        self.MESSAGE_WORKERS = int(os.getenv('MESSAGE_WORKERS', '16'))
+        self.SENDER_CACHE_SIZE = int(os.getenv('SENDER_CACHE_SIZE', '5000'))
+        self.SENDER_CACHE_TTL = float(os.getenv('SENDER_CACHE_TTL', '3600'))
+
+        # Outbound Telegram send limits
+        self.SEND_GLOBAL_PER_SECOND = float(os.getenv('SEND_GLOBAL_PER_SECOND', '10'))
+        self.SEND_CHAT_INTERVAL = float(os.getenv('SEND_CHAT_INTERVAL', '1.0'))
+        self.SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+        self.SEND_MAX_FLOOD_WAIT = float(os.getenv('SEND_MAX_FLOOD_WAIT', '300'))
+
+        # Load shedding when AI answers pile up
+        self.OVERLOAD_HIGH_WATERMARK = int(os.getenv('OVERLOAD_HIGH_WATERMARK', '50'))
+        self.OVERLOAD_LOW_WATERMARK = int(os.getenv('OVERLOAD_LOW_WATERMARK', '30'))
+        self.OVERLOAD_STALE_SECONDS = float(os.getenv('OVERLOAD_STALE_SECONDS', '120'))
+        self.OVERLOAD_DEFER_SECONDS = float(os.getenv('OVERLOAD_DEFER_SECONDS', '10'))
+        self.OVERLOAD_MAX_DEFERS = int(os.getenv('OVERLOAD_MAX_DEFERS', '3'))
+        self.OVERLOAD_RECENT_SECONDS = float(os.getenv('OVERLOAD_RECENT_SECONDS', '300'))
+        self.STREAMING_MODE = os.getenv('STREAMING_MODE', 'off').lower()
+        self.STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+        self.HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1500'))
+        self.ENABLE_HISTORY_SUMMARY = os.getenv('ENABLE_HISTORY_SUMMARY', 'true').lower() == 'true'
+        self.SUMMARY_STALE_TURNS = int(os.getenv('SUMMARY_STALE_TURNS', '6'))
+        self.CHAT_SESSION_POOL_SIZE = int(os.getenv('CHAT_SESSION_POOL_SIZE', '500'))
+        self.LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+        self.LLM_REQUESTS_PER_MINUTE = float(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+        self.LLM_TOKENS_PER_MINUTE = float(os.getenv('LLM_TOKENS_PER_MINUTE', '32000'))
+        self.LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+        self.LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '1.0'))
+
+        # Response cache for short frequent messages
+        self.ENABLE_RESPONSE_CACHE = os.getenv('ENABLE_RESPONSE_CACHE', 'false').lower() == 'true'
+        self.RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+        self.RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+        self.RESPONSE_CACHE_VARIANTS = int(os.getenv('RESPONSE_CACHE_VARIANTS', '3'))
+
+        # Storage configuration
+        self.HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'sqlite').lower()
+        self.HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '1000'))
+        self.HISTORY_CACHE_MAX_MB = float(os.getenv('HISTORY_CACHE_MAX_MB', '64'))
+        self.HISTORY_CACHE_TTL = float(os.getenv('HISTORY_CACHE_TTL', '1800'))
+        self.PERSIST_FLUSH_INTERVAL = float(os.getenv('PERSIST_FLUSH_INTERVAL', '2.0'))
+        self.PERSIST_MAX_DIRTY = int(os.getenv('PERSIST_MAX_DIRTY', '100'))
+        self.STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', '30'))
+        self.STATS_FLUSH_EVERY = int(os.getenv('STATS_FLUSH_EVERY', '500'))
+        self.STATS_HOURLY_RETENTION_DAYS = int(os.getenv('STATS_HOURLY_RETENTION_DAYS', '14'))
+        self.STATS_DAILY_RETENTION_DAYS = int(os.getenv('STATS_DAILY_RETENTION_DAYS', '365'))
+
+        # Prometheus metrics endpoint
+        self.ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'false').lower() == 'true'
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
 
         # Personalities
         self.personalities: Dict[str, Any] = self._load_personalities()
+        # Configs know their own key, display names may repeat
+        for key, personality in self.personalities.items():
+            personality['key'] = key
 
         # Ignored users
         self.ignored_users: set = set()
@@ -91,7 +167,7 @@ class Config:
             missing.append('TELEGRAM_API_ID')
         if not self.TELEGRAM_API_HASH:
             missing.append('TELEGRAM_API_HASH')
-        if not self.GEMINI_API_KEY:
+        if not self.GEMINI_API_KEY and self.LLM_BACKEND != 'mock':
             missing.append('GEMINI_API_KEY')
 
         return len(missing) == 0, missing
@@ -111,11 +187,14 @@ class Config:
         return user_id in self.ignored_users
 
     def _save_ignored_users(self):
+        """Schedule ignored users write in background"""
+        get_persistence().mark_dirty('ignored_users', self._write_ignored_users, lambda: list(self.ignored_users))
+
+    def _write_ignored_users(self, ignored_users: list):
         """Save ignored users to file"""
         ignored_file = self.DATA_DIR / 'ignored_users.json'
         try:
-            with open(ignored_file, 'w', encoding='utf-8') as f:
-                json.dump(list(self.ignored_users), f)
+            atomic_write_json(ignored_file, ignored_users)
         except Exception as e:
             print(f"Error saving ignored users: {e}")
 